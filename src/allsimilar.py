@@ -0,0 +1,179 @@
+#!/usr/bin/python
+
+# findsimilar.py for the whole corpus at once, split into shards that can run on several processes or machines.
+#
+# Usage: allsimilar.py <shard_dir> <corpus_dir> [<needle_dir> ...]
+#
+# The needles (everything in corpus_dir, if no needle_dirs are given) are split by filename into
+# $XDSHARDS shards (default 100).  Each finished shard is saved in shard_dir and not run again, so an
+# interrupted run picks up where it stopped.  $XDJOBS shards are run at once (0 for one per cpu).
+# Set XDPART=k/m to only run part k of m, e.g. on m machines that share (or later combine) shard_dir.
+# shard_dir also records the dirs, XDSHARDS and corpus stamps its shards are for (see get_params); it won't
+# be used for anything else, so start a new one (or remove it) after changing any of them.
+#
+# Once every shard is done, the results are merged in findsimilar.py's format: to stdout if needle_dirs
+# were given, otherwise into corpus_dir/<pubid>/similar.txt for each publisher.
+
+import sys
+import os
+import os.path
+import zlib
+import hashlib
+import itertools
+
+import xdfile
+import findsimilar
+
+# set before the pool is started, so the workers share them
+haystack = None
+needles = { } # [shard] -> [xd, ...]
+
+def get_shard(fn, nshards):
+    return (zlib.crc32(xdfile.get_base_filename(fn)) & 0xffffffff) % nshards
+
+def parse_part(spec):
+    # "k/m" -> (k, m)
+    k, m = [ int(x) for x in spec.split("/") ]
+    assert 1 <= k <= m, "bad part %s" % spec
+    return k, m
+
+def get_params(corpusdir, needledirs, nshards):
+    # what the shards depend on: the dirs, the shard count and the stamps of all the files (see xdfile.find_shards)
+    stamps = hashlib.md5()
+    for shard, entries in xdfile.find_shards(corpusdir, *needledirs):
+        stamps.update(repr((shard, entries)))
+    return "corpus %s\nneedles %s\nshards %d\nstamps %s\n" % (corpusdir, " ".join(needledirs), nshards, stamps.hexdigest())
+
+def check_params(sharddir, params):
+    # records params in sharddir, or checks that its shards were made with them; False if they weren't
+    fn = os.path.join(sharddir, "params.txt")
+    if os.path.exists(fn):
+        return file(fn).read() == params
+    if any(f.startswith("similar-") for f in os.listdir(sharddir)):
+        return False  # from before params were recorded
+
+    tmpfn = "%s.%d.tmp" % (fn, os.getpid())
+    with open(tmpfn, "w") as f:
+        f.write(params)
+    os.rename(tmpfn, fn)
+    return True
+
+def shard_path(sharddir, i, nshards):
+    return os.path.join(sharddir, "similar-%04d-of-%04d.txt" % (i, nshards))
+
+def similar_key(line):
+    # similar.txt lines are sorted by needle, then percentage, then the other filename
+    parts = line.split()
+    try:
+        pct = int(parts[2])
+    except (IndexError, ValueError):
+        pct = 0
+    return parts[0], pct, parts[1]
+
+def similar_lines(needles):
+    for needle, dups in findsimilar.find_all_similar(needles, haystack):
+        for pct, a, b, answers in dups:
+            yield "%s %s %d %d\n" % (a, b, int(pct*100), len(answers))
+
+def run_shard(args):
+    sharddir, i, nshards = args
+    lines = sorted(similar_lines(needles.get(i, [ ])), key=similar_key)
+
+    fn = shard_path(sharddir, i, nshards)
+    tmpfn = "%s.%d.tmp" % (fn, os.getpid())
+    with open(tmpfn, "w") as f:
+        f.writelines(lines)
+    os.rename(tmpfn, fn)  # only finished shards ever exist
+
+    return i, len(lines)
+
+def merge_shards(sharddir, nshards):
+    lines = [ ]
+    for i in xrange(nshards):
+        lines.extend(file(shard_path(sharddir, i, nshards)).read().splitlines(True))
+
+    lines.sort(key=similar_key)
+    return lines
+
+def get_pubid(fn, corpusdir):
+    return os.path.relpath(fn, corpusdir).split(os.sep)[0]
+
+def write_similar(corpusdir, lines):
+    # writes lines to corpusdir/<pubid>/similar.txt, by the publisher of the needle (the first filename).
+    # returns the lines that aren't under a publisher directory.
+    bypub = { } # [pubid] -> [line, ...]
+    for L in lines:
+        bypub.setdefault(get_pubid(L.split(" ", 1)[0], corpusdir), [ ]).append(L)
+
+    rest = [ ]
+    for pubid, publines in sorted(bypub.items()):
+        pubdir = os.path.join(corpusdir, pubid)
+        if os.path.isdir(pubdir):
+            with open(os.path.join(pubdir, "similar.txt"), "w") as f:
+                f.writelines(publines)
+        else:
+            rest.extend(publines)
+
+    return rest
+
+def main():
+    global haystack
+
+    sharddir, corpusdir = sys.argv[1:3]
+    needledirs = sys.argv[3:]
+    nshards = int(os.environ.get("XDSHARDS") or 100)
+    k, m = parse_part(os.environ.get("XDPART") or "1/1")
+    jobs = xdfile.get_jobs()
+
+    if not os.path.isdir(sharddir):
+        os.makedirs(sharddir)
+
+    if not check_params(sharddir, get_params(corpusdir, needledirs, nshards)):
+        print >>sys.stderr, "%s has shards for other dirs, XDSHARDS or corpus files; use a new shard dir (or remove it)" % sharddir
+        sys.exit(1)
+
+    todo = [ i for i in xrange(nshards) if i % m == k - 1 and not os.path.exists(shard_path(sharddir, i, nshards)) ]
+    if todo:
+        corpus = xdfile.load_corpus(corpusdir, compact=True)
+        haystack = findsimilar.make_grid_index(corpus.values())
+        if needledirs:
+            xds = xdfile.load_corpus(*needledirs, compact=True).values()
+        else:
+            xds = corpus.values()
+
+        for xd in xds:
+            if xd.grid:
+                needles.setdefault(get_shard(xd.filename, nshards), [ ]).append(xd)
+
+        args = [ (sharddir, i, nshards) for i in todo ]
+        pool = None
+        if jobs > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs)
+            results = pool.imap_unordered(run_shard, args)
+        else:
+            results = itertools.imap(run_shard, args)
+
+        try:
+            for n, (i, nlines) in enumerate(results):
+                print >>sys.stderr, "\rshard %d: %d similar (%d/%d)" % (i, nlines, n+1, len(todo)),
+            print >>sys.stderr
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+    missing = [ i for i in xrange(nshards) if not os.path.exists(shard_path(sharddir, i, nshards)) ]
+    if missing:
+        print >>sys.stderr, "%d/%d shards still to do (in other XDPARTs); not merging yet" % (len(missing), nshards)
+        return
+
+    lines = merge_shards(sharddir, nshards)
+    if needledirs:
+        sys.stdout.writelines(lines)
+        return
+
+    sys.stdout.writelines(write_similar(corpusdir, lines))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+# every clue in the corpus, in an sqlite database with a full-text index of the clues.
+#
+# Usage: cluedb.py build <db> <corpus_dir_or_zip> ...
+#          adds (or updates, or removes) the clues of files that changed since the last build
+#        cluedb.py answer <db> <ANSWER>
+#          every use of that answer: date, publisher, author, clue
+#        cluedb.py clue <db> <words>
+#          every clue matching the words (sqlite full-text query syntax, e.g. 'Hari' or 'mae NEAR west')
+
+import sys
+import os
+import re
+import sqlite3
+
+import xdfile
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, filename TEXT UNIQUE, stamp TEXT,
+                                  publisher TEXT, date TEXT, author TEXT);
+CREATE TABLE IF NOT EXISTS clues (id INTEGER PRIMARY KEY, fileid INTEGER, pos TEXT, clue TEXT, answer TEXT);
+CREATE INDEX IF NOT EXISTS clues_answer ON clues (answer);
+CREATE INDEX IF NOT EXISTS clues_fileid ON clues (fileid);
+CREATE VIRTUAL TABLE IF NOT EXISTS clues_fts USING fts4 (clue);
+"""
+
+def connect(dbfn):
+    db = sqlite3.connect(dbfn)
+    db.executescript(SCHEMA)
+    return db
+
+def get_metadata(xd):
+    # (publisher, date, author), from the headers if possible, else from the filename
+    m = re.match(r"([A-Za-z]*)(\d{4}-\d{2}-\d{2})", xdfile.get_base_filename(xd.filename))
+    abbr, datestr = m.groups() if m else ("", "")
+
+    publisher = xd.get_header("Publisher") or xdfile.publishers.get(abbr.lower(), abbr)
+    date = xd.get_header("Date") or datestr
+    author = xd.get_header("Author") or xd.get_header("Creator") or ""
+    return publisher, date, author
+
+def remove_file(db, fileid):
+    db.execute("DELETE FROM clues_fts WHERE docid IN (SELECT id FROM clues WHERE fileid = ?)", (fileid,))
+    db.execute("DELETE FROM clues WHERE fileid = ?", (fileid,))
+    db.execute("DELETE FROM files WHERE id = ?", (fileid,))
+
+def add_file(db, xd, stamp, clueid):
+    # clueid is the next unused clues.id; returns the next one after these
+    publisher, date, author = get_metadata(xd)
+    fileid = db.execute("INSERT INTO files (filename, stamp, publisher, date, author) VALUES (?, ?, ?, ?, ?)",
+                        (xd.filename, repr(stamp), publisher, date, author)).lastrowid
+
+    rows = [ (clueid + i, fileid, u"%s%s" % pos, clue, answer) for i, (pos, clue, answer) in enumerate(xd.clues) ]
+    db.executemany("INSERT INTO clues (id, fileid, pos, clue, answer) VALUES (?, ?, ?, ?, ?)", rows)
+    db.executemany("INSERT INTO clues_fts (docid, clue) VALUES (?, ?)", [ (r[0], r[3]) for r in rows ])
+
+    return clueid + len(rows)
+
+def build(db, *pathnames):
+    known = dict((fn, (fileid, stamp)) for fileid, fn, stamp in db.execute("SELECT id, filename, stamp FROM files"))
+
+    nextid = (db.execute("SELECT MAX(id) FROM clues").fetchone()[0] or 0) + 1
+    nadded = 0
+    nfailed = 0
+    seen = set()
+    for shard, entries in xdfile.find_shards(*pathnames):
+        entries = [ (fullfn, stamp) for fullfn, stamp in entries if fullfn not in seen ]  # e.g. a dir and a file in it
+        seen.update(fullfn for fullfn, stamp in entries)
+        changed = [ (fullfn, stamp) for fullfn, stamp in entries if known.get(fullfn, (None, None))[1] != repr(stamp) ]
+        if not changed:
+            continue
+
+        stamps = dict(changed)
+        for fullfn, xd in xdfile.load_shard(shard, changed, cachedir=os.environ.get("XDCACHE"), partial=True):
+            if fullfn in known:
+                remove_file(db, known[fullfn][0])
+            nextid = add_file(db, xd, stamps[fullfn], nextid)
+            del stamps[fullfn]
+            nadded += 1
+            print >>sys.stderr, "\r% 6d %s" % (nadded, xdfile.get_base_filename(fullfn)),
+
+        for fullfn in stamps:  # didn't parse; its old clues are out of date too
+            if fullfn in known:
+                remove_file(db, known[fullfn][0])
+            nfailed += 1
+
+        db.commit()
+
+    removed = [ fileid for fn, (fileid, stamp) in known.items() if fn not in seen ]
+    for fileid in removed:
+        remove_file(db, fileid)
+    db.commit()
+
+    print >>sys.stderr, "\r%d files added or updated, %d removed, %d failed to parse" % (nadded, len(removed), nfailed)
+
+def find_answer(db, answer):
+    return db.execute("""SELECT files.date, files.publisher, files.author, clues.clue FROM clues
+                         JOIN files ON files.id = clues.fileid
+                         WHERE clues.answer = ? ORDER BY files.date""", (answer.upper(),))
+
+def find_clue(db, query):
+    return db.execute("""SELECT clues.answer, files.date, files.publisher, clues.clue FROM clues_fts
+                         JOIN clues ON clues.id = clues_fts.docid JOIN files ON files.id = clues.fileid
+                         WHERE clues_fts MATCH ? ORDER BY clues.answer, files.date""", (query,))
+
+def main():
+    cmd, dbfn = sys.argv[1:3]
+    args = [ a.decode("utf-8") for a in sys.argv[3:] ]
+    db = connect(dbfn)
+
+    if cmd == "build":
+        build(db, *sys.argv[3:])
+    elif cmd == "answer":
+        rows = find_answer(db, u" ".join(args))
+    elif cmd == "clue":
+        rows = find_clue(db, u" ".join(args))
+    else:
+        print >>sys.stderr, "unknown command %s" % cmd
+        sys.exit(1)
+
+    if cmd != "build":
+        for row in rows:
+            print u"\t".join(unicode(v or "") for v in row).encode("utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,16 @@
 
 import sys
 import xdfile
+import heapq
+import bisect
+import binascii
 import itertools
+import operator
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # find_similar_to falls back to comparing grids one at a time
 
 # inverse of hamming distance
 # optimized version
@@ -37,19 +46,226 @@ def grid_similarity(a, b):
         return 1
 
     # add in a little bit f
-    total_diffs = sum(itertools.imap(unicode.__eq__, astr, bstr))/float(max(len(astr), len(bstr)))
+    total_diffs = count_same_chars(astr, bstr)/float(max(len(astr), len(bstr)))
     
     return (r + total_diffs) / float(tot + 1)
 
+def count_same_chars(a, b):
+    # sum(itertools.imap(unicode.__eq__, a, b)), a byte at a time in C when both are ascii:
+    # xor them as big ints, and count the zero bytes
+    n = min(len(a), len(b))
+    if not n:
+        return 0
+
+    try:
+        abytes = a[:n].encode("ascii")
+        bbytes = b[:n].encode("ascii")
+    except UnicodeError:
+        return sum(itertools.imap(unicode.__eq__, a, b))
+
+    x = int(binascii.hexlify(abytes), 16) ^ int(binascii.hexlify(bbytes), 16)
+    return binascii.unhexlify("%0*x" % (2*n, x)).count("\0")
+
 def same_answers(a, b):
-    ans1 = set(sol for pos, clue, sol in a.clues)
-    ans2 = set(sol for pos, clue, sol in b.clues)
-    return ans1 & ans2
+    return a.get_answers() & b.get_answers()
+
+def grid_shape(xd):
+    return len(xd.grid), len(xd.grid[0])
+
+def count_blocks(xd):
+    return sum(row.count(xdfile.BLOCK_CHAR) for row in xd.grid)
+
+class grid_index:
+    # a haystack for find_similar_to, grouped by grid size and sorted by number of blocks,
+    # so that needles are only compared against grids that could be similar enough
+    def __init__(self, xds, buckets=None):
+        # buckets: as self.buckets, if already known (e.g. from xdsnapshot); then xds are ignored
+        self.xds = [ ]
+        self.buckets = { } # [(nrows, ncols)] -> ([nblocks, ...], [xd, ...])
+
+        if buckets is not None:
+            self.buckets = buckets
+            for shape, (blocks, bucket) in sorted(buckets.items()):
+                self.xds.extend(bucket)
+            return
+
+        for nblocks, xd in sorted((count_blocks(xd), xd) for xd in xds if xd.grid):
+            blocks, bucket = self.buckets.setdefault(grid_shape(xd), ([ ], [ ]))
+            blocks.append(nblocks)
+            bucket.append(xd)
+            self.xds.append(xd)
+
+    def __iter__(self):
+        return iter(self.xds)
+
+    def __len__(self):
+        return len(self.xds)
+
+    def candidate_range(self, needle, min_pct=0):
+        # every cell that is a block in one grid and not the other is a mismatch
+        shape = grid_shape(needle)
+        blocks, bucket = self.buckets.get(shape, ([ ], [ ]))
+        nblocks = count_blocks(needle)
+        maxdiff = len(needle.grid) * len(needle.grid[0]) * (1 - min_pct) + 1e-6
+        lo = bisect.bisect_left(blocks, nblocks - maxdiff)
+        hi = bisect.bisect_right(blocks, nblocks + maxdiff)
+        return shape, lo, hi
+
+    def candidates(self, needle, min_pct=0):
+        shape, lo, hi = self.candidate_range(needle, min_pct)
+        return self.buckets.get(shape, ([ ], [ ]))[1][lo:hi]
+
+    def matches(self, needle, min_pct=0):
+        return grid_matches(needle, self.candidates(needle, min_pct), min_pct)
+
+    def batch_matches(self, needles, min_pct=0):
+        for needle in needles:
+            yield needle, list(self.matches(needle, min_pct))
+
+    def updated(self, added, removed):
+        # a new index of the same kind, with added and without removed; sizes they don't touch are shared with this one
+        removed_ids = set(id(xd) for xd in removed)
+        shapes = set(grid_shape(xd) for xd in itertools.chain(added, removed) if xd.grid)
+        xds = [ xd for shape in shapes for xd in self.buckets.get(shape, ([ ], [ ]))[1] if id(xd) not in removed_ids ]
+        return self.merged(self.__class__(xds + list(added)), shapes)
+
+    def merged(self, part, shapes):
+        # this index with the buckets of shapes replaced by those of part
+        buckets = dict((shape, b) for shape, b in self.buckets.items() if shape not in shapes)
+        buckets.update(part.buckets)
+        return self.__class__([ ], buckets)
+
+def grid_cells(grid):
+    # the whole grid as one string, or None if it isn't rectangular
+    if isinstance(grid, xdfile.xdgrid):
+        return grid.cells
+    if any(len(row) != len(grid[0]) for row in grid):
+        return None
+    return u"".join(grid)
+
+def cell_codes(cells):
+    # one integer per cell: the byte for str, the code point for unicode
+    if isinstance(cells, str):
+        return numpy.frombuffer(cells, dtype=numpy.uint8)
+    return numpy.frombuffer(cells.encode("utf-32-le"), dtype="<u4")
+
+class numpy_grid_index(grid_index):
+    # grid_index that compares needles against a whole bucket at once.
+    # each bucket is packed into an (ngrids, nrows*ncols) array of cell codes, uint8 unless some grid needs more.
+    max_batch_bytes = 1 << 26  # size of the boolean array compared per batch of needles
+    max_batch_needles = 256
 
-def find_similar_to(needle, haystack, min_pct=0.3, num_answers=0):
-    ret = [ ]
+    def __init__(self, xds, buckets=None, arrays=None, ragged=None):
+        # buckets, arrays, ragged: as self.buckets, self.arrays and self.ragged, if already known
+        grid_index.__init__(self, xds, buckets)
+        self.arrays = { }  # [(nrows, ncols)] -> codes, one row per grid in the bucket
+        self.ragged = { }  # [(nrows, ncols)] -> [i, ...] in the bucket that aren't rectangular, compared the slow way
+
+        if arrays is not None:
+            self.arrays, self.ragged = arrays, ragged
+            return
+
+        for shape, (blocks, bucket) in self.buckets.items():
+            ncells = shape[0] * shape[1]
+            ragged = [ ]
+            rows = [ ]
+            for i, xd in enumerate(bucket):
+                cells = grid_cells(xd.grid)
+                if cells is None:
+                    ragged.append(i)
+                    cells = "\0" * ncells
+                rows.append(cell_codes(cells))
+
+            codes = numpy.vstack(rows)
+            if codes.max() < 256:
+                codes = codes.astype(numpy.uint8)
+            self.arrays[shape] = codes
+            self.ragged[shape] = ragged
+
+    def merged(self, part, shapes):
+        buckets = dict((shape, b) for shape, b in self.buckets.items() if shape not in shapes)
+        arrays = dict((shape, a) for shape, a in self.arrays.items() if shape not in shapes)
+        ragged = dict((shape, r) for shape, r in self.ragged.items() if shape not in shapes)
+        buckets.update(part.buckets)
+        arrays.update(part.arrays)
+        ragged.update(part.ragged)
+        return self.__class__([ ], buckets, arrays, ragged)
+
+    def count_matches(self, shape, needles, lo=0, hi=None):
+        # number of equal cells between each needle and each grid in bucket[lo:hi], as an (nneedles, ngrids) array
+        codes = self.arrays[shape][lo:hi]
+        needle_codes = numpy.vstack([ cell_codes(grid_cells(needle.grid)) for needle in needles ])
+        if needle_codes.max() < 256:
+            needle_codes = needle_codes.astype(numpy.uint8)
+
+        counts = numpy.empty((len(needles), len(codes)), dtype=numpy.int32)
+        step = max(1, self.max_batch_bytes // max(1, codes.size))
+        for i in xrange(0, len(needles), step):
+            eq = codes[numpy.newaxis, :, :] == needle_codes[i:i+step, numpy.newaxis, :]
+            counts[i:i+step] = eq.sum(axis=2)
+
+        bucket = self.buckets[shape][1]
+        if hi is None:
+            hi = len(bucket)
+        for j in self.ragged[shape]:
+            if lo <= j < hi:
+                for k, needle in enumerate(needles):
+                    try:
+                        counts[k, j - lo] = fast_grid_similarity(needle, bucket[j])
+                    except Exception:
+                        counts[k, j - lo] = 0
+
+        return counts
+
+    def matches_from_counts(self, needle, shape, counts, min_pct, lo=0):
+        nsquares = len(needle.grid) * len(needle.grid[0])
+        bucket = self.buckets[shape][1]
+        for j in numpy.flatnonzero(counts / float(nsquares) >= min_pct):
+            xd = bucket[lo + j]
+            if xd.filename != needle.filename:
+                yield int(counts[j]) / float(nsquares), xd
+
+    def matches(self, needle, min_pct=0):
+        if grid_cells(needle.grid) is None:
+            return grid_index.matches(self, needle, min_pct)
+
+        shape, lo, hi = self.candidate_range(needle, min_pct)
+        if shape not in self.arrays or lo >= hi:
+            return iter([ ])
+
+        counts = self.count_matches(shape, [ needle ], lo, hi)[0]
+        return self.matches_from_counts(needle, shape, counts, min_pct, lo)
+
+    def batch_matches(self, needles, min_pct=0):
+        # needles of the same size are compared against their bucket together
+        byshape = { }
+        for needle in needles:
+            if needle.grid and grid_cells(needle.grid) is not None:
+                byshape.setdefault(grid_shape(needle), [ ]).append(needle)
+            else:
+                yield needle, list(grid_index.matches(self, needle, min_pct)) if needle.grid else [ ]
+
+        for shape, same_size in byshape.items():
+            if shape not in self.arrays:
+                for needle in same_size:
+                    yield needle, [ ]
+                continue
+
+            for i in xrange(0, len(same_size), self.max_batch_needles):
+                batch = same_size[i:i+self.max_batch_needles]
+                counts = self.count_matches(shape, batch)
+                for needle, needle_counts in itertools.izip(batch, counts):
+                    yield needle, list(self.matches_from_counts(needle, shape, needle_counts, min_pct))
+
+def make_grid_index(xds):
+    # the fastest grid_index available here
+    if numpy:
+        return numpy_grid_index(xds)
+    return grid_index(xds)
+
+def grid_matches(needle, xds, min_pct=0):
     nsquares = len(needle.grid) * len(needle.grid[0])
-    for xd in haystack:
+    for xd in xds:
         if xd.filename == needle.filename: continue
         try:
             pct = fast_grid_similarity(needle, xd) / float(nsquares)
@@ -57,18 +273,43 @@ def find_similar_to(needle, haystack, min_pct=0.3, num_answers=0):
             pct = 0
 
         if pct >= min_pct:
-            s = same_answers(needle, xd)
-            if len(s) >= num_answers:
-                ret.append((pct, needle, xd, s))
-    return ret
+            yield pct, xd
+
+def with_answers(needle, matches, num_answers=0, top_k=None):
+    # (pct, needle, xd, shared answers) for each (pct, xd) in matches that shares at least num_answers;
+    # with top_k, only that many of the most similar are kept (most similar first)
+    if top_k is not None and not num_answers:
+        matches = heapq.nlargest(top_k, matches, key=operator.itemgetter(0))  # so only these need answers
+
+    ret = ( (pct, needle, xd, same_answers(needle, xd)) for pct, xd in matches )
+    ret = ( r for r in ret if len(r[3]) >= num_answers )
+    if top_k is not None:
+        return heapq.nlargest(top_k, ret, key=operator.itemgetter(0))
+    return list(ret)
+
+def find_similar_to(needle, haystack, min_pct=0.3, num_answers=0, top_k=None):
+    if isinstance(haystack, grid_index):
+        matches = haystack.matches(needle, min_pct)
+    else:
+        matches = grid_matches(needle, haystack, min_pct)
+    return with_answers(needle, matches, num_answers, top_k)
+
+def find_all_similar(needles, haystack, min_pct=0.3, num_answers=0, top_k=None):
+    # yields (needle, find_similar_to(needle, haystack)) for each needle, though not necessarily in order
+    if isinstance(haystack, grid_index):
+        for needle, matches in haystack.batch_matches(needles, min_pct):
+            yield needle, with_answers(needle, matches, num_answers, top_k)
+    else:
+        for needle in needles:
+            yield needle, find_similar_to(needle, haystack, min_pct, num_answers, top_k)
 
 def main():
-    corpus = xdfile.load_corpus(sys.argv[1])
-    needles = xdfile.load_corpus(*sys.argv[2:]) 
+    corpus = xdfile.load_corpus(sys.argv[1], compact=True)
+    needles = xdfile.load_corpus(*sys.argv[2:], compact=True)
+    haystack = make_grid_index(corpus.values())
 
-    for i, needle in enumerate(needles.values()):
+    for i, (needle, dups) in enumerate(find_all_similar(needles.values(), haystack)):
         print >>sys.stderr, "\r% 3d/%d %s" % (i, len(needles), needle),
-        dups = find_similar_to(needle, corpus.values())
         for pct, a, b, answers in sorted(dups):
             print a, b, int(pct*100), len(answers)
 
@@ -1,26 +1,103 @@
 #!/usr/bin/env python
 
+# Usage: getclues.py <corpus_dir_or_zip> ...
+#   prints answer,clue,count for every clue in the corpus.
+#   Set XDRUNSIZE to keep memory bounded: the clues are then sorted on disk, that many at a time
+#   (and the sorted runs merged MERGE_FANIN at a time, to keep the number of open files bounded too).
+
+import os
+import sys
+import heapq
+import marshal
+import tempfile
+import itertools
+import collections
+
 import xdfile
+import mapreduce
 
-all_clues = { }
-corpus = xdfile.main_load()
-for xd in corpus.values():
+MERGE_FANIN = 64  # most runs merged at once
+
+def map_clues(xd):
+    # [answer] -> Counter([clue])
+    ret = { }
     for pos, clue, answer in xd.clues:
-        if answer not in all_clues:
-            uses = { }
-            all_clues[answer] = uses
-        else:
-            uses = all_clues[answer]
-
-        if clue not in uses:
-            uses[clue] = [ xd ]
-        else:
-            uses[clue].append(xd)
-
-for answer, uses in sorted(all_clues.items()):
-    for clue, xds in sorted(uses.items()):
+        ret.setdefault(answer, collections.Counter())[clue] += 1
+    return ret
+
+def count_clues(pathnames):
+    # yields (answer, clue, count) in order, with the whole clue table in memory
+    all_clues = mapreduce.map_reduce({ "clues": map_clues }, *pathnames)["clues"] or { }
+    for answer, uses in sorted(all_clues.items()):
+        for clue, n in sorted(uses.items()):
+            yield answer, clue, n
+
+def write_run(records):
+    f = tempfile.TemporaryFile()
+    for r in sorted(records):
+        marshal.dump(r, f)
+    f.seek(0)
+    return f
+
+def read_run(f):
+    while True:
+        try:
+            yield marshal.load(f)
+        except EOFError:
+            return
+
+def merge_runs(runs):
+    # one run of all the records of runs, which are closed
+    f = tempfile.TemporaryFile()
+    for r in heapq.merge(*[ read_run(run) for run in runs ]):
+        marshal.dump(r, f)
+    for run in runs:
+        run.close()
+    f.seek(0)
+    return f
+
+def count_clues_sorted(pathnames, runsize):
+    # yields (answer, clue, count) in order, from sorted runs of runsize (answer, clue) on disk
+    levels = [ ] # [i] -> [ run, ... ], each of MERGE_FANIN**i runs merged; MERGE_FANIN of them make one of level i+1
+    try:
+        records = [ ]
+        for xd in xdfile.iter_corpus(*pathnames):
+            records.extend((answer, clue) for pos, clue, answer in xd.clues)
+            if len(records) >= runsize:
+                run = write_run(records)
+                records = [ ]
+                for level in levels:
+                    level.append(run)
+                    if len(level) < MERGE_FANIN:
+                        break
+                    run = merge_runs(level)
+                    del level[:]
+                else:
+                    levels.append([ run ])
+
+        runs = [ run for level in levels for run in level ]
+        while len(runs) >= MERGE_FANIN:
+            runs = [ merge_runs(runs[:MERGE_FANIN]) ] + runs[MERGE_FANIN:]
+        levels = [ runs ]
+
+        merged = heapq.merge(*([ read_run(f) for f in runs ] + [ iter(sorted(records)) ]))
+        for (answer, clue), uses in itertools.groupby(merged):
+            yield answer, clue, sum(1 for r in uses)
+    finally:
+        for level in levels:
+            for f in level:
+                f.close()
+
+if __name__ == "__main__":
+    runsize = int(os.environ.get("XDRUNSIZE") or 0)
+    if runsize:
+        counts = count_clues_sorted(sys.argv[1:], runsize)
+    else:
+        counts = count_clues(sys.argv[1:])
+
+    for answer, clue, n in counts:
         try:
-            print u",".join([ answer, clue, str(len(xds)) ])
+            print u",".join([ answer, clue, str(n) ])
         except:
             print
-            print "EXCEPT ", clue.encode("utf-8", 'replace'), map(str, xds)
+            print "EXCEPT ", clue.encode("utf-8", 'replace'), n
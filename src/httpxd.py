@@ -3,12 +3,27 @@
 # apt-get install python-cherrypy3
 
 import cherrypy
+import cgi
+import os
+import sys
+import json
+import time
+import errno
+import bisect
+import signal
 import string
 import urllib
+import functools
+import threading
+import contextlib
+import collections
+import multiprocessing
 
 import mkwww
 import findsimilar
 import xdfile
+import xdsnapshot
+import patternsearch
 
 body_html = """
 <form method="get" action="find">
@@ -19,18 +34,332 @@ Paste the grid here in text format (use '#' as block):
 </textarea>
 <br/>
 <button type="submit">Find similar</button>
+</form>
+
+<form method="get" action="pattern">
+Or find answers that fit a pattern (use '?' for any letter, and commas between crossing answers):
+<br/>
+<input type="text" name="q"/>
+<button type="submit">Find answers</button>
 </form>"""
 
+# the series /metrics reports; all are known up front (see metrics)
+ENDPOINTS = [ "search", "find", "diff", "pattern", "api_find", "api_diff", "reload", "metrics" ]
+STAGES = { "find": [ "scan", "answers", "sort", "render" ],
+           "api_find": [ "scan", "answers", "sort", "render" ],
+           "diff": [ "load", "render" ],
+           "api_diff": [ "load", "similarity", "answers", "render" ],
+           "pattern": [ "index", "match", "render" ] }
+CACHES = [ "find", "diff" ]
+
+class metrics(object):
+    # request counts and timings, kept in memory shared with the processes serve_forked forks, so that any of
+    # them reports for all.  That memory can't grow once they're forked, so every series is declared here.
+    buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)  # histogram bounds, in seconds
+
+    def __init__(self, counters, histograms, slow_seconds=None):
+        # counters, histograms: [ (name, labels) ], with labels a tuple of (label, value)
+        # slow_seconds: requests that take longer are logged to stderr, with the time of each stage
+        self.counters = counters
+        self.histograms = histograms
+        self.slow_seconds = slow_seconds
+        self.slots = { } # [(name, labels)] -> index of its first value
+        n = 0
+        for key in counters:
+            self.slots[key] = n
+            n += 1
+        for key in histograms:
+            self.slots[key] = n
+            n += len(self.buckets) + 2  # count per bucket, then over the last, then the total seconds
+        self.values = multiprocessing.RawArray('d', n)
+        self.lock = multiprocessing.Lock()
+
+    def add(self, name, labels=(), n=1):
+        i = self.slots[(name, labels)]
+        with self.lock:
+            self.values[i] += n
+
+    def observe(self, name, labels, seconds):
+        i = self.slots[(name, labels)]
+        with self.lock:
+            self.values[i + bisect.bisect_left(self.buckets, seconds)] += 1
+            self.values[i + len(self.buckets) + 1] += seconds
+
+    def format(self):
+        # in the Prometheus text format
+        with self.lock:
+            values = self.values[:]
+
+        lines = [ ]
+        for kind, series in [ ("counter", self.counters), ("histogram", self.histograms) ]:
+            names = [ ]
+            for name, labels in series:
+                if name not in names:
+                    names.append(name)
+
+            for name in names:
+                lines.append("# TYPE %s %s" % (name, kind))
+                for labels in [ labels for n, labels in series if n == name ]:
+                    lines.extend(self.format_series(kind, name, labels, values[self.slots[(name, labels)]:]))
+
+        return "".join(line + "\n" for line in lines)
+
+    def format_series(self, kind, name, labels, values):
+        # values: from the first of this series
+        if kind == "counter":
+            return [ "%s%s %s" % (name, format_labels(labels), format_value(values[0])) ]
+
+        lines = [ ]
+        n = 0
+        for le, count in zip(self.buckets + ("+Inf",), values):
+            n += count
+            lines.append("%s_bucket%s %s" % (name, format_labels(labels + (("le", le),)), format_value(n)))
+        lines.append("%s_sum%s %s" % (name, format_labels(labels), format_value(values[len(self.buckets) + 1])))
+        lines.append("%s_count%s %s" % (name, format_labels(labels), format_value(n)))
+        return lines
+
+def format_value(v):
+    return "%d" % v if v == int(v) else repr(v)
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join('%s="%s"' % (k, v) for k, v in labels)
+
+def make_metrics(slow_seconds=None):
+    counters = [ ("xd_requests_total", (("endpoint", e),)) for e in ENDPOINTS ]
+    counters += [ ("xd_request_errors_total", (("endpoint", e),)) for e in ENDPOINTS ]
+    counters += [ ("xd_cache_%s_total" % k, (("cache", c),)) for c in CACHES for k in ("hits", "misses") ]
+    histograms = [ ("xd_request_seconds", (("endpoint", e),)) for e in ENDPOINTS ]
+    histograms += [ ("xd_stage_seconds", (("endpoint", e), ("stage", st))) for e in ENDPOINTS for st in STAGES.get(e, [ ]) ]
+    return metrics(counters, histograms, slow_seconds)
+
+class request_timer(object):
+    # the time taken by a request, and by each of its stages
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.start = time.time()
+        self.stages = [ ] # [ (stage, seconds) ]
+
+    def finish(self, metrics, failed=False):
+        seconds = time.time() - self.start
+        labels = (("endpoint", self.endpoint),)
+        metrics.add("xd_requests_total", labels)
+        if failed:
+            metrics.add("xd_request_errors_total", labels)
+        metrics.observe("xd_request_seconds", labels, seconds)
+        for st, t in self.stages:
+            metrics.observe("xd_stage_seconds", labels + (("stage", st),), t)
+
+        if metrics.slow_seconds is not None and seconds >= metrics.slow_seconds:
+            print >>sys.stderr, "slow request: %.3fs %s?%s %s" % (seconds, cherrypy.request.path_info, cherrypy.request.query_string,
+                                                                 " ".join("%s=%.3f" % st for st in self.stages))
+
+def timed(endpoint):
+    # decorator for the methods serving endpoint, whose object has request_metrics
+    def decorate(f):
+        @functools.wraps(f)
+        def wrapper(self, *args, **kwargs):
+            timer = cherrypy.request.timer = request_timer(endpoint)
+            failed = True
+            try:
+                r = f(self, *args, **kwargs)
+                failed = False
+                return r
+            except cherrypy.HTTPRedirect:
+                failed = False
+                raise
+            finally:
+                status = int(str(cherrypy.response.status or 200)[:3])  # may be set as an int or as "404 Not Found"
+                timer.finish(self.request_metrics, failed or status >= 400)
+        return wrapper
+    return decorate
+
+@contextlib.contextmanager
+def stage(name):
+    # times a stage of the current request (see timed)
+    t = time.time()
+    try:
+        yield
+    finally:
+        timer = getattr(cherrypy.request, "timer", None)
+        if timer:
+            timer.stages.append((name, time.time() - t))
+
+class lru_cache(object):
+    # the most recently used size entries, each kept for at most ttl seconds (forever if ttl is None)
+    def __init__(self, size=1000, ttl=None, metrics=None, name=None):
+        # metrics: to count hits and misses in, as name
+        self.size = size
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # [key] -> (expiry time, value), least recently used first
+        self.lock = threading.Lock()
+        self.metrics = metrics
+        self.labels = (("cache", name),)
+
+    def get(self, key, compute):
+        # the cached value for key, or compute() (which is then cached)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry and (entry[0] is None or entry[0] > now):
+                self.entries[key] = entry
+            else:
+                entry = None
+
+        if self.metrics:
+            self.metrics.add("xd_cache_hits_total" if entry else "xd_cache_misses_total", self.labels)
+        if entry:
+            return entry[1]
+
+        value = compute()  # outside the lock, so other requests aren't held up
+
+        with self.lock:
+            self.entries[key] = (now + self.ttl if self.ttl else None, value)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+def parse_cache_spec(spec):
+    # "size" or "size/ttl seconds" (as $XDHTTPCACHE) -> (size, ttl)
+    size, _, ttl = (spec or "1000").partition("/")
+    return int(size), int(ttl) if ttl else None
+
+def load_files(paths, old_files):
+    # returns (files, [ key, ... ]) for the .xd files under paths, in the order load_corpus takes them,
+    # with files as corpus_state.files; only those whose stamps aren't the same in old_files are parsed
+    files = { }
+    order = [ ]
+    changed = [ ] # [ (shard, [ (fullfn, stamp), ... ]) ] to parse
+    for shard, entries in xdfile.find_shards(*paths):
+        source = shard and shard[0]
+        todo = [ ]
+        for fullfn, stamp in entries:
+            key = (source, fullfn)
+            order.append(key)
+            if key in old_files and old_files[key][0] == stamp:
+                files[key] = old_files[key]
+            else:
+                todo.append((fullfn, stamp))
+        if todo:
+            changed.append((shard, todo))
+
+    expected = iter([ ((shard and shard[0], fullfn), stamp) for shard, todo in changed for fullfn, stamp in todo ])
+    for fullfn, xd in xdfile.load_shards(changed, os.environ.get("XDCACHE"), xdfile.get_jobs(), partial=True):
+        key, stamp = next(expected)
+        while key[1] != fullfn:  # one that couldn't be parsed
+            key, stamp = next(expected)
+        xd.compact_grid()
+        files[key] = (stamp, xd)
+
+    return files, order
+
+class corpus_state(object):
+    # the corpus and its indexes as of one load.  Never changed once made (a reload makes another), so a request
+    # that takes httpxd.state once sees the same corpus throughout, however many reloads happen meanwhile.
+    def __init__(self, files, order, old=None, haystack=None):
+        # old: the previous state, whose indexes are updated rather than made again
+        self.generation = old.generation + 1 if old else 0
+        self.files = files  # [(zip filename or None, filename)] -> (stamp, xd)
+        self.corpus = { } # [basefn] -> xd, the last of each name (as load_corpus)
+        for key in order:
+            if key in files:
+                self.corpus[xdfile.get_base_filename(key[1])] = files[key][1]
+
+        if haystack:
+            self.haystack = haystack
+        elif old:
+            old_ids = set(id(xd) for xd in old.corpus.values())
+            new_ids = set(id(xd) for xd in self.corpus.values())
+            added = [ xd for xd in self.corpus.values() if id(xd) not in old_ids ]
+            removed = [ xd for xd in old.corpus.values() if id(xd) not in new_ids ]
+            self.haystack = old.haystack.updated(added, removed) if added or removed else old.haystack
+        else:
+            self.haystack = findsimilar.make_grid_index(self.corpus.values())
+
+        self.example_grid = '<div class="fixed">%s</div>' % "<br/>".join(self.corpus.values()[0].grid) if self.corpus else ""
+        self.patterns = None  # patternsearch.pattern_index, made on first use
+
+    def get_pattern_index(self):
+        if not self.patterns:
+            self.patterns = patternsearch.pattern_index(self.corpus.values())
+        return self.patterns
+
 class httpxd(object):
-    def __init__(self):
-        self.corpus = xdfile.main_load()
-        self.example_grid = '<div class="fixed">%s</div>' % "<br/>".join(self.corpus.values()[0].grid)
+    max_results = 200  # most similar grids to list
+
+    def __init__(self, paths=(), snapshot=None, cache_size=1000, cache_ttl=None, slow_seconds=None):
+        # paths: of the corpus, loaded now (unless there's a snapshot) and again by update_corpus
+        # snapshot: directory made by xdsnapshot.py, to start from instead
+        # cache_size, cache_ttl: of the /find and /diff results kept (see lru_cache)
+        # slow_seconds: log requests that take longer (see metrics)
+        self.paths = paths
+        self.request_metrics = make_metrics(slow_seconds)
+        self.find_cache = lru_cache(cache_size, cache_ttl, self.request_metrics, "find")
+        self.diff_cache = lru_cache(cache_size, cache_ttl, self.request_metrics, "diff")
+        self.api = httpxd_api(self)
+        self.update_lock = threading.Lock()
+        self.parent_pid = None  # of serve_forked, in the processes it forks
+
+        if snapshot:
+            snap = xdsnapshot.snapshot(snapshot)
+            self.state = corpus_state(snap.files, sorted(snap.files), haystack=snap.haystack)
+            print >>sys.stderr, "%s puzzles" % len(self.state.corpus)
+        else:
+            self.state = None
+            self.update_corpus()
+
+    def update_corpus(self):
+        # picks up the files under self.paths that were added, changed or removed since the last load,
+        # parsing only those; requests already running carry on with the corpus as it was.
+        # returns (number of files parsed, number removed), or None if there are no paths to reload from;
+        # the state (and its generation) is kept as it is if nothing was parsed or removed
+        if self.state and not self.paths:
+            print >>sys.stderr, "no corpus paths to reload from; keeping the %s puzzles loaded" % len(self.state.corpus)
+            return None
+
+        with self.update_lock:
+            old = self.state
+            old_files = old.files if old else { }
+            files, order = load_files(self.paths, old_files)
+            nparsed = sum(1 for key, v in files.items() if old_files.get(key) is not v)
+            nremoved = sum(1 for key in old_files if key not in files)
+            if nparsed or nremoved or not old:
+                self.state = corpus_state(files, order, old)
+
+                self.find_cache.clear()  # entries made from the old state could still be added; they're keyed by generation
+                self.diff_cache.clear()
+
+        print >>sys.stderr, "%s puzzles; %d parsed, %d removed" % (len(self.state.corpus), nparsed, nremoved)
+        return nparsed, nremoved
+
+    @cherrypy.expose
+    @timed("reload")
+    def reload(self):
+        # re-reads the corpus files that changed; only from this machine
+        if cherrypy.request.remote.ip not in ("127.0.0.1", "::1"):
+            raise cherrypy.HTTPError(403)
+
+        cherrypy.response.headers['Content-Type'] = 'text/plain'
+        if self.parent_pid:
+            os.kill(self.parent_pid, signal.SIGHUP)  # it reloads and starts new processes (see serve_forked)
+            return "reload requested\n"
+
+        counts = self.update_corpus()
+        if counts is None:
+            return "no corpus paths to reload from\n"
+        return "%d parsed, %d removed\n" % counts
 
     @cherrypy.expose
     def index(self):
         raise cherrypy.HTTPRedirect("/search")
 
     @cherrypy.expose
+    @timed("search")
     def search(self):
         return mkwww.html_header.format(title="Crossword Grid Search") + body_html + mkwww.html_footer
 
@@ -47,16 +376,43 @@ class httpxd(object):
         return mkwww.html_header.format(title="Crossword Grid Search") + body_html + '<div class="error">Error: %s</div>' % errmsg + mkwww.html_footer
     
 
-    @cherrypy.expose
-    def find(self, grid="", xd=""):
-        xdobj = self.corpus.get(xd) or httpxd.xd_from_grid(grid)
+    def find_matches(self, state, grid, xd):
+        # (letters of the grid, find_similar_to results); the results are None if the grid is too small to search
+        xdobj = state.corpus.get(xd) or httpxd.xd_from_grid(grid)
         gridstr = "".join(filter(lambda x: x in string.uppercase, "".join(xdobj.grid).upper()))
         if len(gridstr) < 15: # one row, wouldn't really consider less than this a match anyway
-            return self.error('please specify a more specific grid than "%s".  Example: <br/>%s' % (gridstr, self.example_grid))
+            return gridstr, None
+
+        if xd in state.corpus:
+            key = (state.generation, "xd", xd)
+        else:
+            key = (state.generation, "grid", "\n".join(xdobj.grid))  # the same grid pasted a little differently is the same search
+
+        def search():
+            # as findsimilar.find_similar_to, in stages
+            with stage("scan"):
+                matches = list(state.haystack.matches(xdobj, 0.3))
+            with stage("answers"):
+                return findsimilar.with_answers(xdobj, matches, top_k=self.max_results)
 
+        return gridstr, self.find_cache.get(key, search)
+
+    @cherrypy.expose
+    @timed("find")
+    def find(self, grid="", xd=""):
+        state = self.state
+        gridstr, dups = self.find_matches(state, grid, xd)
+        if dups is None:
+            return self.error('please specify a more specific grid than "%s".  Example: <br/>%s' % (gridstr, state.example_grid))
+
+        with stage("sort"):
+            dups = sorted(dups)
+        with stage("render"):
+            return self.render_find(dups, grid, xd)
+
+    def render_find(self, dups, grid, xd):
         index_list = []
-        dups = findsimilar.find_similar_to(xdobj, self.corpus.values())
-        for pct, needle, other, same_answers in sorted(dups):
+        for pct, needle, other, same_answers in dups:
             pct *= 100
             if xd:
                 parms = { "left": xdfile.get_base_filename(other.filename), "right": xd }
@@ -95,19 +451,217 @@ class httpxd(object):
 
         return r
 
+    def diff_key(self, state, left, right):
+        key = (state.generation, left, right)
+        if left not in state.corpus or right not in state.corpus:
+            key += (cherrypy.request.remote.ip,)  # a pasted grid's diff shows who pasted it
+        return key
+
     @cherrypy.expose
+    @timed("diff")
     def diff(self, left="", right=""):
+        state = self.state
+        return self.diff_cache.get(self.diff_key(state, left, right), lambda: self.gendiff(state, left, right))
+
+    @cherrypy.expose
+    @timed("pattern")
+    def pattern(self, q=""):
+        patterns = q.replace(",", " ").split()
+        if not patterns:
+            return self.error("please give a pattern, like A?P?E")
+
+        with stage("index"):
+            index = self.state.get_pattern_index()
+        with stage("match"):
+            if len(patterns) == 1:
+                found = index.find(patterns[0])[:self.max_results]
+            else:
+                found = index.find_puzzles(patterns)[:self.max_results]
+
+        with stage("render"):
+            return self.render_pattern(patterns, found)
+
+    def render_pattern(self, patterns, found):
+        r = mkwww.html_header.format(title="Answers matching %s" % cgi.escape(" ".join(patterns)))
+        r += "<ul>"
+        if len(patterns) == 1:
+            for n, answer, examples in found:
+                links = " ".join('<a href="/find?%s">%s</a>' % (urllib.urlencode({ "xd": fn }), fn)
+                                    for fn in (xdfile.get_base_filename(fn) for fn in examples))
+                r += "\n<li>%s (%d) %s</li>" % (cgi.escape(answer), n, links)
+        else:
+            for fn, answers in found:
+                fn = xdfile.get_base_filename(fn)
+                r += '\n<li><a href="/find?%s">%s</a> %s</li>' % (urllib.urlencode({ "xd": fn }), fn, cgi.escape(" ".join(",".join(a) for a in answers)))
+        r += "</ul>"
+
+        r += '<a href="/">search again</a>'
+        r += mkwww.html_footer
+        return r
 
-        xd1 = self.corpus.get(left) or httpxd.xd_from_grid(left)
-        xd2 = self.corpus.get(right) or httpxd.xd_from_grid(right)
+    @cherrypy.expose
+    @timed("metrics")
+    def metrics(self):
+        cherrypy.response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+        state = self.state
+        r = self.request_metrics.format()
+        r += "# TYPE xd_corpus_puzzles gauge\nxd_corpus_puzzles %d\n" % len(state.corpus)
+        r += "# TYPE xd_corpus_generation gauge\nxd_corpus_generation %d\n" % state.generation
+        r += "# TYPE xd_cache_entries gauge\n"
+        for name, cache in [ ("find", self.find_cache), ("diff", self.diff_cache) ]:
+            r += 'xd_cache_entries{cache="%s"} %d\n' % (name, len(cache.entries))
+        return r
+
+    def gendiff(self, state, left, right):
+        xd1 = state.corpus.get(left) or httpxd.xd_from_grid(left)
+        xd2 = state.corpus.get(right) or httpxd.xd_from_grid(right)
 
         if xd1.grid and xd2.grid:
-            diffstr, pct = mkwww.gendiff(xd1, xd2)
+            with stage("load"):
+                xd1, xd2 = xdsnapshot.full_xdfile(xd1), xdsnapshot.full_xdfile(xd2)
+            with stage("render"):
+                diffstr, pct = mkwww.gendiff(xd1, xd2)
             return diffstr
         else:
             return self.error("Need two grids to diff")
 
-cherrypy.config.update({'server.socket_host': '0.0.0.0',
-                        'server.socket_port': 80,
-                       })
-cherrypy.quickstart(httpxd())
+class httpxd_api(object):
+    # /api/find and /api/diff: the same searches as /find and /diff, as JSON
+    def __init__(self, root):
+        self.root = root
+        self.request_metrics = root.request_metrics
+
+    @staticmethod
+    def json_response(response):
+        # response: (status, json text)
+        status, text = response
+        cherrypy.response.status = status
+        cherrypy.response.headers['Content-Type'] = 'application/json'
+        return text
+
+    @cherrypy.expose
+    @timed("api_find")
+    def find(self, grid="", xd=""):
+        gridstr, dups = self.root.find_matches(self.root.state, grid, xd)
+        if dups is None:
+            return self.json_response((400, json.dumps({ "error": "grid too small to search: %s" % gridstr })))
+
+        with stage("sort"):
+            dups = sorted(dups, key=lambda r: (-r[0], r[2].filename))
+        with stage("render"):
+            results = [ ]
+            for pct, needle, other, same_answers in dups:
+                results.append({ "xd": xdfile.get_base_filename(other.filename),
+                                 "pct": pct * 100,
+                                 "author": other.get_header("Author") or "",
+                                 "shared_answers": sorted(same_answers) })
+            return self.json_response((200, json.dumps({ "results": results })))
+
+    @cherrypy.expose
+    @timed("api_diff")
+    def diff(self, left="", right=""):
+        state = self.root.state
+        key = ("api",) + self.root.diff_key(state, left, right)
+        return self.json_response(self.root.diff_cache.get(key, lambda: self.gendiff(state, left, right)))
+
+    def gendiff(self, state, left, right):
+        # (status, json text)
+        xd1 = state.corpus.get(left) or httpxd.xd_from_grid(left)
+        xd2 = state.corpus.get(right) or httpxd.xd_from_grid(right)
+        if not xd1.grid or not xd2.grid:
+            return 400, json.dumps({ "error": "need two grids to diff" })
+
+        with stage("load"):
+            xd1, xd2 = xdsnapshot.full_xdfile(xd1), xdsnapshot.full_xdfile(xd2)
+        with stage("similarity"):
+            pct = findsimilar.grid_similarity(xd1, xd2) * 100
+        with stage("answers"):
+            shared = sorted(findsimilar.same_answers(xd1, xd2))
+        with stage("render"):
+            return 200, json.dumps({ "left": xd1.to_unicode(), "right": xd2.to_unicode(), "pct": pct, "shared_answers": shared })
+
+def serve_forked(root, host, port, servers):
+    # serves root from servers processes, forked after the corpus is loaded so they all share it
+    # (copy-on-write, or the same mapped pages with a snapshot), each accepting on the same listening socket.
+    # On SIGHUP (or /reload) this process updates the corpus and forks new ones; the old ones finish the
+    # requests they have and exit.
+    from wsgiref import simple_server
+
+    class quiet_handler(simple_server.WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    app = cherrypy.tree.mount(root, "/")
+    server = simple_server.make_server(host, port, app, handler_class=quiet_handler)
+    server.timeout = 1  # how often a process checks whether it's been told to stop
+
+    def serve(parent_pid):
+        stopping = [ ]
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, lambda signum, frame: stopping.append(signum))
+        root.parent_pid = parent_pid
+        try:
+            while not stopping:
+                server.handle_request()
+        finally:
+            os._exit(0)
+
+    def fork_children():
+        root.state.get_pattern_index()  # made once, here, rather than in every process
+        children = set()
+        for i in xrange(servers):
+            pid = os.fork()
+            if not pid:
+                serve(os.getppid())
+            children.add(pid)
+        return children
+
+    reload_requested = [ ]
+    signal.signal(signal.SIGHUP, lambda signum, frame: reload_requested.append(signum))
+
+    children = fork_children()
+    current = set(children)
+    print >>sys.stderr, "serving on %s:%s from %d processes" % (host, port, servers)
+    try:
+        while current:
+            if reload_requested:
+                del reload_requested[:]
+                if not any(root.update_corpus() or ()):
+                    continue  # nothing to reload from, or nothing changed: the processes serving now carry on
+                for pid in current:
+                    os.kill(pid, signal.SIGUSR1)
+                current = fork_children()
+                children |= current
+
+            try:
+                pid, status = os.wait()
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+                continue
+            children.discard(pid)
+            current.discard(pid)
+    finally:
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+if __name__ == "__main__":
+    cache_size, cache_ttl = parse_cache_spec(os.environ.get("XDHTTPCACHE"))
+    slow_seconds = float(os.environ["XDSLOWLOG"]) if os.environ.get("XDSLOWLOG") else None
+    root = httpxd(sys.argv[1:], snapshot=os.environ.get("XDSNAPSHOT"), cache_size=cache_size, cache_ttl=cache_ttl,
+                  slow_seconds=slow_seconds)
+
+    servers = xdfile.get_jobs(int(os.environ.get("XDSERVERS") or 1))  # XDJOBS is for loading the corpus
+    if servers > 1:
+        serve_forked(root, '0.0.0.0', 80, servers)
+    else:
+        cherrypy.config.update({'server.socket_host': '0.0.0.0',
+                                'server.socket_port': 80,
+                               })
+        # SIGHUP picks up the changes to the corpus (instead of restarting)
+        cherrypy.engine.signal_handler.handlers['SIGHUP'] = lambda: threading.Thread(target=root.update_corpus).start()
+        cherrypy.quickstart(root)
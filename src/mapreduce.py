@@ -0,0 +1,104 @@
+#!/usr/bin/python
+
+# one pass over the corpus for any number of statistics, a shard at a time (see xdfile.find_shards),
+# on a pool of processes.
+#
+# Each mapper is a function of one xdfile that returns a number, Counter, dict, list or set for it;
+# the results for all the files are merged together (see merge).  The merged results of each shard are kept in the
+# cache dir, if any, so only shards that changed are mapped again.  They're cached by mapper name and code
+# (see mapper_key), so editing a mapper maps every shard again; editing only a function it calls doesn't,
+# so rename the mapper (e.g. "words2") then.
+
+import sys
+import os
+import types
+import hashlib
+import collections
+
+import xdfile
+import xdcache
+
+def merge(a, b):
+    # b merged into a: numbers and Counters are added, dicts merged by key, lists concatenated, sets unioned
+    if a is None:
+        return b
+    if b is None:
+        return a
+
+    if isinstance(a, (int, long, float)):
+        return a + b
+    elif isinstance(a, collections.Counter):
+        a.update(b)
+    elif isinstance(a, dict):
+        for k, v in b.iteritems():
+            a[k] = merge(a.get(k), v)
+    elif isinstance(a, list):
+        a.extend(b)
+    elif isinstance(a, set):
+        a |= b
+    else:
+        raise TypeError("can't merge %s" % type(a).__name__)
+
+    return a
+
+def code_fingerprint(code):
+    # changes when the code does, but not when it only moves within its file
+    parts = [ code.co_code, repr(code.co_names) ]
+    for c in code.co_consts:
+        parts.append(code_fingerprint(c) if isinstance(c, types.CodeType) else repr(c))
+    return hashlib.md5("\0".join(parts)).hexdigest()
+
+def mapper_key(name, mapper):
+    code = getattr(mapper, "__code__", None)
+    return name, getattr(mapper, "__module__", None), getattr(mapper, "__name__", None), code and code_fingerprint(code)
+
+def map_shard(mappers, shard, entries, cachedir=None):
+    # returns { name: merged results of mapper over the files of shard }
+    cache = None
+    cachekey = (shard, sorted(mapper_key(name, mapper) for name, mapper in mappers.items()))
+    if cachedir and shard:
+        cache = xdcache.corpus_cache(cachedir)
+        cached = cache.load(cachekey)
+        if cached.get("entries") == entries:
+            return cached["results"]
+
+    results = dict((name, None) for name in mappers)
+    for fullfn, xd in xdfile.load_shard(shard, entries, cachedir):
+        for name, mapper in mappers.items():
+            results[name] = merge(results[name], mapper(xd))
+
+    if cache:
+        cache.save(cachekey, { "entries": entries, "results": results })
+
+    return results
+
+def map_reduce(mappers, *pathnames, **kwargs):
+    # mappers: { name: mapper(xd) }
+    # returns { name: results of mapper for every file under pathnames, merged }
+    # cache, jobs: as for xdfile.load_corpus
+    cachedir = kwargs.get("cache", os.environ.get("XDCACHE"))
+    jobs = xdfile.get_jobs(kwargs.get("jobs"))
+
+    shards = list(xdfile.find_shards(*pathnames))
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        try:
+            pending = [ pool.apply_async(map_shard, (mappers, shard, entries, cachedir)) for shard, entries in shards ]
+            shard_results = (r.get() for r in pending)
+            results = reduce_shards(shard_results, len(shards))
+        finally:
+            pool.terminate()
+    else:
+        shard_results = (map_shard(mappers, shard, entries, cachedir) for shard, entries in shards)
+        results = reduce_shards(shard_results, len(shards))
+
+    return dict((name, results.get(name)) for name in mappers)
+
+def reduce_shards(shard_results, nshards):
+    results = { }
+    for i, r in enumerate(shard_results):
+        print >>sys.stderr, "\r% 6d/%d shards" % (i+1, nshards),
+        merge(results, r)
+    print >>sys.stderr, ""
+    return results
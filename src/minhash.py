@@ -0,0 +1,174 @@
+#!/usr/bin/python
+
+# MinHash signatures of each puzzle's set of answers, and an LSH index of them, to find puzzles that
+# share a lot of answers (even on a different grid) without comparing every pair.
+#
+# Usage: minhash.py <corpus_dir> <needle_dir> ...
+#   prints "needle other pct num_answers" for each needle and corpus puzzle with at least 30% of
+#   their answers in common (shared / all answers of the two).
+#
+# Each signature is NUM_BANDS*BAND_ROWS minimum hashes, split into bands; two puzzles are candidates if
+# all of one band's hashes are the same.  More bands (or fewer rows) finds more of the less similar
+# puzzles, at the cost of more candidates to check.  Signatures are kept in $XDCACHE, if set.
+
+import sys
+import os
+import os.path
+import zlib
+import struct
+import random
+import hashlib
+import cPickle as pickle
+
+import xdfile
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+PRIME = (1 << 31) - 1
+NUM_BANDS = 32
+BAND_ROWS = 3
+SIGNATURE_VERSION = 1
+
+def answer_hash(answer):
+    if isinstance(answer, unicode):
+        answer = answer.encode("utf-8")
+    return zlib.crc32(answer) & 0xffffffff
+
+class minhasher:
+    # nhashes random (a*x + b) % PRIME permutations, the same for a given seed
+    def __init__(self, nhashes, seed=0):
+        r = random.Random(seed)
+        self.coeffs = [ (r.randrange(1, PRIME), r.randrange(0, PRIME)) for i in xrange(nhashes) ]
+        if numpy:
+            self.a = numpy.array([ a for a, b in self.coeffs ], dtype=numpy.uint64)
+            self.b = numpy.array([ b for a, b in self.coeffs ], dtype=numpy.uint64)
+
+    def signature(self, answers):
+        # the minimum of each hash over the answers, packed as 4 bytes each; None if no answers
+        hs = [ answer_hash(ans) for ans in answers ]
+        if not hs:
+            return None
+
+        if numpy:
+            mins = ((numpy.outer(numpy.array(hs, dtype=numpy.uint64), self.a) + self.b) % PRIME).min(axis=0)
+            return mins.astype("<u4").tostring()
+
+        mins = [ min((a*x + b) % PRIME for x in hs) for a, b in self.coeffs ]
+        return struct.pack("<%dI" % len(mins), *mins)
+
+def answers_digest(answers):
+    return hashlib.md5(u"\n".join(sorted(answers)).encode("utf-8")).digest()
+
+class signature_cache:
+    # { filename: (answers_digest, signature) }, kept in cachedir between runs
+    def __init__(self, cachedir, nhashes, seed=0):
+        self.fn = os.path.join(cachedir, "answer-signatures.pickle")
+        self.params = (SIGNATURE_VERSION, nhashes, seed)
+        self.changed = False
+        self.signatures = { }
+        try:
+            with open(self.fn, 'rb') as f:
+                params, signatures = pickle.load(f)
+            if params == self.params:
+                self.signatures = signatures
+        except Exception:
+            pass  # missing, stale or corrupt; will be rebuilt
+
+    def get(self, filename, digest):
+        v = self.signatures.get(filename)
+        if v and v[0] == digest:
+            return v[1]
+
+    def put(self, filename, digest, sig):
+        self.signatures[filename] = (digest, sig)
+        self.changed = True
+
+    def save(self):
+        if not self.changed:
+            return
+        if not os.path.isdir(os.path.dirname(self.fn)):
+            os.makedirs(os.path.dirname(self.fn))
+        tmpfn = "%s.%d.tmp" % (self.fn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+            pickle.dump((self.params, self.signatures), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfn, self.fn)
+
+class answer_index:
+    # LSH index of the corpus by answer set
+    def __init__(self, xds, bands=NUM_BANDS, rows=BAND_ROWS, cachedir=None):
+        self.bands = bands
+        self.rows = rows
+        self.hasher = minhasher(bands*rows)
+        self.buckets = { } # [band number + band of signature] -> [xd, ...]
+
+        cache = None
+        if cachedir:
+            cache = signature_cache(cachedir, bands*rows)
+
+        for xd in xds:
+            sig = self.signature(xd, cache)
+            if sig:
+                for key in self.band_keys(sig):
+                    self.buckets.setdefault(key, [ ]).append(xd)
+
+        if cache:
+            cache.save()
+
+    def signature(self, xd, cache=None):
+        answers = xd.get_answers()
+        if not cache:
+            return self.hasher.signature(answers)
+
+        digest = answers_digest(answers)
+        sig = cache.get(xd.filename, digest)
+        if not sig:
+            sig = self.hasher.signature(answers)
+            if sig:
+                cache.put(xd.filename, digest, sig)
+        return sig
+
+    def band_keys(self, sig):
+        n = self.rows*4
+        return [ chr(i) + sig[i*n:(i+1)*n] for i in xrange(self.bands) ]
+
+    def candidates(self, needle):
+        # puzzles that share at least one band with needle
+        sig = self.signature(needle)
+        if not sig:
+            return [ ]
+
+        ret = { } # [filename] -> xd
+        for key in self.band_keys(sig):
+            for xd in self.buckets.get(key, [ ]):
+                if xd.filename != needle.filename:
+                    ret[xd.filename] = xd
+        return ret.values()
+
+    def find_similar(self, needle, min_pct=0.3):
+        # returns [ (pct, needle, xd, shared answers) ] as findsimilar.find_similar_to,
+        # with pct the portion of all their answers that the two puzzles share
+        answers = needle.get_answers()
+        ret = [ ]
+        for xd in self.candidates(needle):
+            other = xd.get_answers()
+            shared = answers & other
+            pct = len(shared) / float(len(answers | other))
+            if pct >= min_pct:
+                ret.append((pct, needle, xd, shared))
+        return ret
+
+def main():
+    corpus = xdfile.load_corpus(sys.argv[1])
+    needles = xdfile.load_corpus(*sys.argv[2:])
+    index = answer_index(corpus.values(), cachedir=os.environ.get("XDCACHE"))
+
+    for i, needle in enumerate(needles.values()):
+        print >>sys.stderr, "\r% 3d/%d %s" % (i, len(needles), needle),
+        for pct, a, b, answers in sorted(index.find_similar(needle), key=lambda r: (r[0], r[2].filename)):
+            print a, b, int(pct*100), len(answers)
+
+if __name__ == "__main__":
+    main()
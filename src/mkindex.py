@@ -9,7 +9,7 @@ import xdfile
 outlines = [ ]
 total_xd = 0
 for metafn in sys.argv[1:]:
-    pubxd = xdfile.xdfile(file(metafn).read(), metafn)
+    pubxd = xdfile.xdfile(file(metafn).read(), metafn, lazy=True)
 
     num_xd = int(pubxd.get_header("num_xd"))
     total_xd += num_xd
@@ -4,6 +4,7 @@ import sys
 import os.path
 import datetime
 import difflib
+import itertools
 
 import xdfile
 import downloadraw
@@ -52,6 +53,17 @@ def get_url(xd):
 
     return downloadraw.get_source(abbr).url(d)
 
+class page_diff(difflib.HtmlDiff):
+    # numbers the anchors of its tables itself, so each page is the same whatever was diffed before (or at the same time);
+    # HtmlDiff numbers them with one count shared by every instance and thread
+    def __init__(self, *args, **kwargs):
+        difflib.HtmlDiff.__init__(self, *args, **kwargs)
+        self.ntables = 0
+
+    def _make_prefix(self):
+        self._prefix = [ "from%d_" % self.ntables, "to%d_" % self.ntables ]
+        self.ntables += 1
+
 def gendiff(xd1, xd2):
     try:
         desc1 = '<a href="%s">%s</a>' % (get_url(xd1), xd1.filename)
@@ -73,7 +85,7 @@ def gendiff(xd1, xd2):
     s1 = xd1.to_unicode()
     s2 = xd2.to_unicode()
 
-    hd = difflib.HtmlDiff(linejunk=lambda x: False)
+    hd = page_diff(linejunk=lambda x: False)
     diff_html = hd.make_table(s1.splitlines(), s2.splitlines(), fromdesc=desc1, todesc=desc2, numlines=False)
 
     ret += '<div class="answers"><br/>Shared answers:<br/> %s</div>' % " ".join(shared)
@@ -119,25 +131,10 @@ def get_index_html(pubid, pubxd, index_list, gridrel):
 
     return out
 
-if __name__ == "__main__":
-
-    OUTPUT_DIR = sys.argv[1]
-    pubid = OUTPUT_DIR.split("/")[-1]
-
-    if len(sys.argv) > 2:
-        similar_txts = sys.argv[2:]
-    else:
-        similar_txts = [ "crosswords/%s/similar.txt" % pubid ]
-    try:
-        os.makedirs(OUTPUT_DIR)
-    except Exception, e:
-        print e
-
-    pubxd = xdfile.xdfile(file("crosswords/%s/meta.txt" % pubid).read()) # just to parse some cached metadata
-
-    left_index_list =  { } # [(olderfn, newerfn)] -> (pct, index_line)
-    right_index_list =  { } # [(olderfn, newerfn)] -> (pct, index_line)
-
+def read_similar(similar_txts, pubid):
+    # [ (older fn, newer fn) ] for each pair in similar_txts with a pubid puzzle, once each, in order
+    pairs = [ ]
+    seen = set()
     for inputfn in similar_txts:
       for line in file(inputfn).read().splitlines():
         if not line: continue
@@ -161,22 +158,82 @@ if __name__ == "__main__":
         except:
             pass # no date in filename
 
+        if (fn1, fn2) not in seen:
+            seen.add((fn1, fn2))
+            pairs.append((fn1, fn2))
+
+    return pairs
+
+def load_puzzles(fns, cachedir=None, jobs=1):
+    # { fn: xdfile } for each of fns that can be read, each parsed just once (or taken from the corpus cache)
+    shards = { } # [dirname] -> [ (fn, stamp) ], as from xdfile.find_shards
+    for fn in sorted(set(fns)):
         try:
-            xd1 = xdfile.xdfile(file(fn1).read(), fn1)
-            xd2 = xdfile.xdfile(file(fn2).read(), fn2)
-        except Exception, e:
+            st = os.stat(fn)
+        except OSError, e:
             print str(e)
             continue
-            
+        shards.setdefault(os.path.dirname(fn), [ ]).append((fn, (st.st_mtime, st.st_size)))
+
+    shards = [ ((None, dirname), entries) for dirname, entries in sorted(shards.items()) ]
+    return dict(xdfile.load_shards(shards, cachedir, jobs, partial=True))
+
+puzzles = { } # [fn] -> xdfile, for render_diff (in the pool's processes too, which are forked after it's filled)
 
-        ret, pct = gendiff(xd1, xd2)
+def render_diff(job):
+    # writes the diff page of fn1 and fn2 to outpath; returns (whether it was written, pct)
+    fn1, fn2, outpath = job
+    ret, pct = gendiff(puzzles[fn1], puzzles[fn2])
+    if ret:
+        file(outpath, 'w').write(ret.encode("utf-8"))
+    return bool(ret), pct
 
-        if not ret:
+def main():
+    OUTPUT_DIR = sys.argv[1]
+    pubid = OUTPUT_DIR.split("/")[-1]
+
+    if len(sys.argv) > 2:
+        similar_txts = sys.argv[2:]
+    else:
+        similar_txts = [ "crosswords/%s/similar.txt" % pubid ]
+    try:
+        os.makedirs(OUTPUT_DIR)
+    except Exception, e:
+        print e
+
+    pubxd = xdfile.xdfile(file("crosswords/%s/meta.txt" % pubid).read(), lazy=True) # just to parse some cached metadata
+
+    left_index_list =  { } # [(olderfn, newerfn)] -> (pct, index_line)
+    right_index_list =  { } # [(olderfn, newerfn)] -> (pct, index_line)
+
+    jobs = xdfile.get_jobs()
+    pairs = read_similar(similar_txts, pubid)
+    puzzles.update(load_puzzles([ fn for pair in pairs for fn in pair ], os.environ.get("XDCACHE"), jobs))
+
+    diffs = [ ] # [ (fn1, fn2, outpath) ]
+    for fn1, fn2 in pairs:
+        if fn1 in puzzles and fn2 in puzzles:
+            outfn = "%s-%s.html" % (xdfile.get_base_filename(fn1), xdfile.get_base_filename(fn2))
+            diffs.append((fn1, fn2, OUTPUT_DIR + "/" + outfn))
+
+    # the diffs are rendered in any order, but the index is made from them in the order of similar_txts
+    if jobs > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs)
+        results = pool.imap(render_diff, diffs, chunksize=8)
+    else:
+        pool = None
+        results = itertools.imap(render_diff, diffs)
+
+    try:
+      for (fn1, fn2, outpath), (written, pct) in itertools.izip(diffs, results):
+        if not written:
             print "%d%%, skipping" % pct
             continue
 
         print fn1, fn2
 
+        xd1, xd2 = puzzles[fn1], puzzles[fn2]
         b1 = xdfile.get_base_filename(fn1)
         b2 = xdfile.get_base_filename(fn2)
         outfn = "%s-%s.html" % (b1, b2)
@@ -198,19 +255,14 @@ if __name__ == "__main__":
         else:
             index_line += ' %s' % aut1
 
-        added = False
         if pubid in fn2:
             right_index_list[(fn1, fn2)] = (pct, index_line, index_txt, b1, b2)
-            added = True
 
         if pubid in fn1:
             left_index_list[(fn1, fn2)] = (pct, index_line, index_txt, b1, b2)
-            added = True
-    
-        if added:
-            file(OUTPUT_DIR + "/" + outfn, 'w').write(ret.encode("utf-8"))
-
-
+    finally:
+        if pool:
+            pool.terminate()
 
     file("%s/index.html" % OUTPUT_DIR, 'w').write(get_index_html(pubid, pubxd, right_index_list, "earlier"))
     file("%s/from.html" % OUTPUT_DIR, 'w').write(get_index_html(pubid, pubxd, left_index_list, "later"))
@@ -225,5 +277,5 @@ if __name__ == "__main__":
                 break
             f.write(Ltxt + '\n')
 
-
-
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+
+# every answer in the corpus, indexed by length and by the letter at each position, to find the answers
+# that fit a pattern (like A?P?E) without looking at every clue.
+#
+# Usage: patternsearch.py <pattern>[,<pattern>...] <corpus_dir_or_zip> ...
+#   with one pattern, prints "puzzles answer example ..." for each answer that fits it, most used first;
+#   with more, prints the puzzles that have an answer fitting each of them (e.g. two crossing answers).
+#   ? or . in a pattern matches any letter.
+
+import sys
+import binascii
+
+import xdfile
+
+WILDCARDS = "?."
+
+def make_bitset(indices, n):
+    # an int with bit i set for each i in indices (all < n)
+    b = bytearray((n + 7) // 8)
+    for i in indices:
+        b[i >> 3] |= 1 << (i & 7)
+    b.reverse()
+    return int(binascii.hexlify(b), 16) if b else 0
+
+def bitset_indices(bits):
+    # the positions of the set bits, lowest first
+    s = bin(bits)[:1:-1]
+    i = s.find("1")
+    while i >= 0:
+        yield i
+        i = s.find("1", i + 1)
+
+class pattern_index:
+    def __init__(self, xds):
+        self.filenames = [ ] # [puzzle number] -> filename
+        self.puzzles = { } # [answer] -> [puzzle number, ...] that used it
+        for n, xd in enumerate(xds):
+            self.filenames.append(xd.filename)
+            for answer in xd.get_answers():
+                self.puzzles.setdefault(answer, [ ]).append(n)
+
+        self.answers = { } # [length] -> [answer, ...]
+        for answer in sorted(self.puzzles):
+            self.answers.setdefault(len(answer), [ ]).append(answer)
+
+        self.bitsets = { } # [(length, position, letter)] -> bitset of answers[length] with that letter there
+        for length, answers in self.answers.items():
+            positions = { }
+            for i, answer in enumerate(answers):
+                for pos, letter in enumerate(answer):
+                    positions.setdefault((length, pos, letter), [ ]).append(i)
+            for k, indices in positions.items():
+                self.bitsets[k] = make_bitset(indices, len(answers))
+
+    def matches(self, pattern):
+        # the answers that fit pattern, in order
+        pattern = pattern.upper()
+        answers = self.answers.get(len(pattern), [ ])
+        bits = (1 << len(answers)) - 1
+        for pos, letter in enumerate(pattern):
+            if letter not in WILDCARDS:
+                bits &= self.bitsets.get((len(pattern), pos, letter), 0)
+                if not bits:
+                    break
+
+        return [ answers[i] for i in bitset_indices(bits) ]
+
+    def find(self, pattern, examples=3):
+        # [ (number of puzzles, answer, [ filename of the first few ]) ], most used first
+        ret = [ (len(self.puzzles[answer]), answer, [ self.filenames[n] for n in self.puzzles[answer][:examples] ])
+                    for answer in self.matches(pattern) ]
+        ret.sort(key=lambda r: (-r[0], r[1]))
+        return ret
+
+    def find_puzzles(self, patterns):
+        # [ (filename, [ answers fitting each pattern ]) ] for the puzzles with an answer fitting every pattern
+        found = None # [puzzle number] -> [ [ answer, ... ] per pattern so far ]
+        for pattern in patterns:
+            byfile = { }
+            for answer in self.matches(pattern):
+                for n in self.puzzles[answer]:
+                    if found is None or n in found:
+                        byfile.setdefault(n, [ ]).append(answer)
+
+            if found is None:
+                found = dict((n, [ answers ]) for n, answers in byfile.items())
+            else:
+                found = dict((n, found[n] + [ answers ]) for n, answers in byfile.items())
+
+        return sorted((self.filenames[n], answers) for n, answers in (found or { }).items())
+
+def main():
+    patterns = sys.argv[1].decode("utf-8").split(",")
+    index = pattern_index(xdfile.load_corpus(*sys.argv[2:]).values())
+
+    if len(patterns) == 1:
+        for n, answer, examples in index.find(patterns[0]):
+            print (u"%d %s %s" % (n, answer, " ".join(xdfile.get_base_filename(fn) for fn in examples))).encode("utf-8")
+    else:
+        for fn, answers in index.find_puzzles(patterns):
+            print (u"%s %s" % (xdfile.get_base_filename(fn), " ".join(",".join(a) for a in answers))).encode("utf-8")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+
+# brings each corpus_dir/<pubid>/similar.txt up to date after puzzles are added, changed or removed,
+# by comparing only those against the corpus, instead of rerunning findsimilar.py for whole publishers.
+#
+# Usage: updatesimilar.py <manifest> <corpus_dir>
+#
+# manifest lists the puzzles that similar.txt already accounts for; without one, every puzzle is new.
+# Run it from the same directory as the findsimilar.py run that made similar.txt (as in xdfind.sh),
+# so the filenames match.  A file that was touched but not changed (e.g. by a fresh checkout) is not
+# compared again.
+#
+# similar.txt must be as findsimilar.py or allsimilar.py write it ("a b pct nanswers" lines); the reduced
+# index.txt that xdfind.sh later moves over it (from mkwww.py) has lost the lines under 25%, so it is refused.
+
+import sys
+import os
+import os.path
+import hashlib
+import cPickle as pickle
+
+import xdfile
+import findsimilar
+import allsimilar
+
+def load_manifest(fn):
+    # { fullfn: (stamp, md5 of the contents or None) }
+    try:
+        with open(fn, 'rb') as f:
+            return pickle.load(f)
+    except IOError:
+        return { }
+
+def save_manifest(fn, manifest):
+    tmpfn = "%s.%d.tmp" % (fn, os.getpid())
+    with open(tmpfn, 'wb') as f:
+        pickle.dump(manifest, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpfn, fn)
+
+def find_changes(corpusdir, manifest):
+    # returns the new manifest, and lists of the fullfns that are new or changed, and that are gone
+    current = { }
+    changed = [ ]
+    for shard, entries in xdfile.find_shards(corpusdir):
+        for fullfn, stamp in entries:
+            old = manifest.get(fullfn)
+            if old and old[0] == stamp:
+                current[fullfn] = old
+                continue
+
+            if shard and shard[0]:
+                digest = None  # the stamp of a .zip member is already a crc of its contents
+            else:
+                digest = hashlib.md5(file(fullfn, 'rb').read()).hexdigest()
+
+            current[fullfn] = (stamp, digest)
+            if not old or not digest or old[1] != digest:
+                changed.append(fullfn)
+
+    removed = [ fullfn for fullfn in manifest if fullfn not in current ]
+    return current, changed, removed
+
+def is_reduced(lines):
+    # True if lines are from mkwww.py's index.txt ("a b pct [*]"), not findsimilar.py's "a b pct nanswers"
+    for L in lines:
+        parts = L.split()
+        if parts and (len(parts) != 4 or not parts[3].isdigit()):
+            return True
+    return False
+
+def similar_lines(changed, corpusdir):
+    # findsimilar.py lines for the changed puzzles, and the same lines from the other side
+    corpus = xdfile.load_corpus(corpusdir, compact=True)
+    haystack = findsimilar.make_grid_index(corpus.values())
+    needles = [ xd for xd in corpus.values() if xd.filename in changed and xd.grid ]
+
+    for needle, dups in findsimilar.find_all_similar(needles, haystack):
+        for pct, a, b, answers in dups:
+            yield "%s %s %d %d\n" % (a, b, int(pct*100), len(answers))
+            if b.filename not in changed:
+                # what findsimilar.py would find for b now; similarity is symmetric
+                yield "%s %s %d %d\n" % (b, a, int(pct*100), len(answers))
+
+def main():
+    manifestfn, corpusdir = sys.argv[1:3]
+
+    manifest = load_manifest(manifestfn)
+    current, changed, removed = find_changes(corpusdir, manifest)
+    print >>sys.stderr, "%d new or changed, %d removed" % (len(changed), len(removed))
+
+    stale = set(changed) | set(removed)
+    reduced = [ simfn for simfn in (os.path.join(corpusdir, pubid, "similar.txt") for pubid in sorted(os.listdir(corpusdir)))
+                    if os.path.isfile(simfn) and is_reduced(file(simfn).read().splitlines()) ]
+    if reduced:
+        print >>sys.stderr, "%s: reduced by mkwww.py, not findsimilar.py output; rerun findsimilar.py or allsimilar.py" % " ".join(reduced)
+        sys.exit(1)
+
+    added = { } # [pubid] -> [line, ...]
+    if changed:
+        for L in similar_lines(set(changed), corpusdir):
+            added.setdefault(allsimilar.get_pubid(L.split(" ", 1)[0], corpusdir), [ ]).append(L)
+
+    if stale:
+        for pubid in sorted(os.listdir(corpusdir)):
+            simfn = os.path.join(corpusdir, pubid, "similar.txt")
+            if os.path.isfile(simfn):
+                lines = [ L for L in file(simfn).read().splitlines(True) if L.strip() ]
+            elif pubid in added and os.path.isdir(os.path.dirname(simfn)):
+                lines = [ ]
+            else:
+                continue
+
+            kept = [ L for L in lines if not stale.intersection(L.split()[:2]) ]
+            new = added.pop(pubid, [ ])
+            if new or len(kept) != len(lines):
+                print >>sys.stderr, "%s: %d removed, %d added" % (simfn, len(lines) - len(kept), len(new))
+                with open(simfn, "w") as f:
+                    f.writelines(sorted(kept + new, key=allsimilar.similar_key))
+
+        for pubid, lines in sorted(added.items()):
+            sys.stdout.writelines(sorted(lines, key=allsimilar.similar_key))  # not under a publisher directory
+
+    if current != manifest:
+        save_manifest(manifestfn, current)
+
+if __name__ == "__main__":
+    main()
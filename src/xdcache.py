@@ -0,0 +1,44 @@
+#!/usr/bin/python
+
+# on-disk cache of parsed xdfiles, so that loading an unchanged corpus doesn't re-parse it.
+#
+# There is one pickle per shard (a directory, or a directory within a .zip; see xdfile.find_shards),
+# holding { fullfn: (stamp, xdfile) }.  An entry is only reused if its stamp still matches.
+
+import os
+import os.path
+import hashlib
+import cPickle as pickle
+
+CACHE_VERSION = 6
+
+
+class corpus_cache:
+    def __init__(self, cachedir):
+        self.cachedir = cachedir
+        if not os.path.isdir(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                pass  # probably created by another process meanwhile
+
+    def shard_path(self, shard):
+        return os.path.join(self.cachedir, hashlib.md5(repr(shard)).hexdigest() + ".pickle")
+
+    def load(self, shard):
+        try:
+            with open(self.shard_path(shard), 'rb') as f:
+                version, cached_shard, entries = pickle.load(f)
+            if version == CACHE_VERSION and cached_shard == shard:
+                return entries
+        except Exception:
+            pass  # missing, stale or corrupt; will be rebuilt
+
+        return { }
+
+    def save(self, shard, entries):
+        fn = self.shard_path(shard)
+        tmpfn = "%s.%d.tmp" % (fn, os.getpid())
+        with open(tmpfn, 'wb') as f:
+            pickle.dump((CACHE_VERSION, shard, entries), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpfn, fn)  # atomic, so concurrent loaders never see a partial shard
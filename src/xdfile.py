@@ -3,10 +3,16 @@
 import sys
 import os
 import os.path
+import re
+import fnmatch
 import stat
+import hashlib
 import string
+import struct
 import zipfile
 
+import xdcache
+
 BLOCK_CHAR = '#'
 EOL = '\n'
 
@@ -59,135 +65,387 @@ publishers = {
 unknownpubs = { }
 all_files = { }
 
+# the same answers, header names and clue positions recur throughout the corpus,
+# so only one copy of each is kept (intern() only takes str)
+interned = { }
+
+def intern_value(v):
+    return interned.setdefault(v, v)
+
+def clue_number(s):
+    # clue numbers are kept as ints, unless that would change how they're written out
+    try:
+        n = int(s)
+    except ValueError:
+        return s
+
+    return n if str(n) == s else s
+
+clue_positions = { }  # "A21" -> ("A", 21)
+
+def parse_clue_position(pos):
+    if pos[0] in string.uppercase:
+        cluedir = pos[0]
+        cluenum = pos[1:]
+    else:
+        cluedir = ""
+        cluenum = pos
+
+    return intern_value((cluedir, clue_number(cluenum)))
+
+
+class xdgrid(object):
+    # a rectangular grid kept as one string instead of a list of rows; otherwise acts like the list
+    __slots__ = ('cells', 'width')
+
+    def __init__(self, rows=()):
+        rows = list(rows)
+        self.width = len(rows[0]) if rows else 0
+        assert all(len(row) == self.width for row in rows), "grid not rectangular"
+
+        self.cells = u"".join(rows)
+        try:
+            self.cells = self.cells.encode("ascii")  # 1 byte/cell instead of 4
+        except UnicodeError:
+            pass
+
+    def __getstate__(self):
+        return self.cells, self.width
+
+    def __setstate__(self, state):
+        self.cells, self.width = state
+
+    def __len__(self):
+        return len(self.cells) // self.width if self.width else 0
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in xrange(*i.indices(len(self))) ]
+
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError("grid row out of range")
+
+        return self.cells[i*self.width:(i+1)*self.width]
+
+    def __iter__(self):
+        for i in xrange(0, len(self.cells), self.width):
+            yield self.cells[i:i+self.width]
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
 
-class xdfile:
-    def __init__(self, xd_contents=None, filename=None):
+    def __repr__(self):
+        return repr(list(self))
+
+    def append(self, row):
+        if not self.width:
+            self.width = len(row)
+        assert len(row) == self.width, "grid not rectangular"
+        self.cells += row
+
+
+def blank_grid(rows):
+    # just the blocks
+    return [ u"".join(c if c == BLOCK_CHAR else u"." for c in row) for row in rows ]
+
+def grid_transforms(rows):
+    # the grid in all 8 rotations and reflections (only as is, if it isn't rectangular)
+    rows = list(rows)
+    if not rows or any(len(row) != len(rows[0]) for row in rows):
+        return [ rows ]
+
+    ret = [ ]
+    for g in (rows, [ u"".join(col) for col in zip(*rows) ]):  # and transposed
+        ret.append(g)
+        ret.append(g[::-1])
+        ret.append([ row[::-1] for row in g ])
+        ret.append([ row[::-1] for row in g[::-1] ])
+    return ret
+
+def canonical_grid_hash(rows):
+    # the same for a grid and any rotation or reflection of it
+    canonical = min(EOL.join(g) for g in grid_transforms(rows))
+    return hashlib.md5(canonical.encode("utf-8")).hexdigest()
+
+
+BLOCK_BITS = "".join("1" if chr(i) == BLOCK_CHAR else "0" for i in xrange(256))  # for str.translate
+
+def blank_fingerprint(rows):
+    # a 64-bit int for the pattern of blocks (and size) of a grid, the same for any rotation or reflection of it
+    bitrows = [ (row.encode("ascii", "replace") if isinstance(row, unicode) else row).translate(BLOCK_BITS) for row in rows ]
+    canonical = min((tuple(len(row) for row in g), int("".join(g) or "0", 2)) for g in grid_transforms(bitrows))
+    return struct.unpack("<q", hashlib.md5("%r %x" % canonical).digest()[:8])[0]
+
+
+# a section ends with two or more blank lines, by the same rules as unicode.splitlines() and strip().
+# (\r\n is one line end; written this way so the regex can start with a plain set, which is faster to search for)
+LINE_END = u"[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029](?:(?<=\r)\n|(?<=\r)(?!\n)|(?<!\r))"
+BLANK = u"[^\\S\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]*"
+SECTION_END = re.compile(LINE_END + u"(?:" + BLANK + LINE_END + u"){2,}", re.UNICODE)
+
+# much quicker for the usual files, with only \n for line ends
+OTHER_LINE_ENDS = re.compile(u"[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]", re.UNICODE)
+NEWLINE_SECTION_END = re.compile(u"\n(?:[^\\S\n]*\n){2,}", re.UNICODE)
+
+SECTIONS = ('headers', 'grid', 'clues', 'notes')
+
+
+class xdfile(object):
+    __slots__ = ('filename', '_headers', '_grid', '_clues', '_notes', 'orig_contents', 'unparsed', 'sections', '_unicode', '_fingerprint', '_hashes')
+
+    def __init__(self, xd_contents=None, filename=None, lazy=False):
         self.filename = filename
-        self.headers = [ ]
-        self.grid = [ ]
-        self.clues = [ ] # list of (("A", 21), "{*Bold*}, {/italic/}, {_underscore_}, or {-overstrike-}", "MARKUP")
-        self.notes = ""
+        self._headers = [ ]
+        self._grid = [ ]
+        self._clues = [ ] # list of (("A", 21), "{*Bold*}, {/italic/}, {_underscore_}, or {-overstrike-}", "MARKUP")
+        self._notes = ""
         self.orig_contents = xd_contents
 
+        # with lazy parsing: the text not yet split into sections, and the sections not yet parsed
+        self.unparsed = None
+        self.sections = None
+
+        self._unicode = None  # to_unicode(), until a section is set again
+        self._fingerprint = None  # blank_fingerprint(grid), until the grid is set again
+        self._hashes = None  # get_grid_hashes(), likewise
+
         if xd_contents:
-            self.parse_xd(xd_contents.decode("utf-8"))
+            self.parse_xd(xd_contents.decode("utf-8"), lazy)
 
     def __str__(self):
         return self.filename
 
+    def __getstate__(self):
+        # the raw contents are not kept in pickles (like the corpus cache)
+        return self.filename, self._headers, self._grid, self._clues, self._notes, self.unparsed, self.sections, self._fingerprint, self._hashes
+
+    def __setstate__(self, state):
+        self.filename, headers, self._grid, clues, self._notes, self.unparsed, self.sections, self._fingerprint, self._hashes = state
+        self.orig_contents = None
+        self._unicode = None
+
+        # unpickling makes new copies of everything
+        if headers is not None:
+            headers = [ (intern_value(k), v) for k, v in headers ]
+        if clues is not None:
+            clues = [ (intern_value(pos), clue, intern_value(answer)) for pos, clue, answer in clues ]
+        self._headers, self._clues = headers, clues
+
+    # the sections are parsed on first use, if parse_xd was lazy
+    def get_section(self, attr, i):
+        v = getattr(self, attr)
+        if v is None:
+            self.split_sections(i+1)
+            lines = self.sections[i]
+            if i == 3:  # notes are everything after the clues
+                self.split_sections(None)
+                lines = self.sections[3:]
+            v = getattr(self, "parse_" + SECTIONS[i])(lines)
+            setattr(self, attr, v)
+
+            if all(getattr(self, "_" + k) is not None for k in SECTIONS):
+                self.unparsed = self.sections = None
+
+        return v
+
+    def set_section(self, attr, v):
+        setattr(self, attr, v)
+        self._unicode = None
+
+    def set_grid(self, v):
+        self.set_section("_grid", v)
+        self._fingerprint = self._hashes = None
+
+    headers = property(lambda self: self.get_section("_headers", 0), lambda self, v: self.set_section("_headers", v))
+    grid = property(lambda self: self.get_section("_grid", 1), set_grid)
+    clues = property(lambda self: self.get_section("_clues", 2), lambda self, v: self.set_section("_clues", v))
+    notes = property(lambda self: self.get_section("_notes", 3), lambda self, v: self.set_section("_notes", v))
+
+    def compact_grid(self):
+        # keep the grid as an xdgrid (if it's rectangular)
+        if self.grid and not isinstance(self.grid, xdgrid):
+            try:
+                self._grid = xdgrid(self.grid)  # the same grid, so the fingerprint and hashes stay
+                self._unicode = None  # not kept for compact grids (see to_unicode)
+            except AssertionError:
+                pass
+
     def get_header(self, fieldname):
         vals = [ v for k, v in self.headers if k == fieldname ]
         if vals:
             assert len(vals) == 1, vals
             return vals[0]
 
-    def parse_xd(self, xd_contents):
-        # placeholders, actual numbering starts at 1
-        section = 0
-        subsection = 0
-
-        # fake blank line at top to allow leading actual blank lines before headers
-        nblanklines = 2
+    def get_answers(self):
+        return set(sol for pos, clue, sol in self.clues)
+
+    def get_grid_hashes(self):
+        # canonical_grid_hash of the filled grid, and of the blank grid; kept as get_blank_fingerprint is
+        if self._hashes is None:
+            self._hashes = canonical_grid_hash(self.grid), canonical_grid_hash(blank_grid(self.grid))
+        return self._hashes
+
+    def get_blank_fingerprint(self):
+        # blank_fingerprint of the grid, kept until the grid is set again (also in the corpus cache);
+        # after changing it in place (e.g. xd.grid.append), assign it again (xd.grid = xd.grid)
+        if self._fingerprint is None:
+            self._fingerprint = blank_fingerprint(self.grid)
+        return self._fingerprint
+
+    def parse_xd(self, xd_contents, lazy=False):
+        if OTHER_LINE_ENDS.search(xd_contents):
+            self.unparsed = (xd_contents, 0, SECTION_END)
+        else:
+            self.unparsed = (xd_contents, 0, NEWLINE_SECTION_END)
+        self.sections = [ ]
+        self._headers = self._grid = self._clues = self._notes = None
+        self._unicode = self._fingerprint = self._hashes = None
+
+        if not lazy:
+            for i, k in enumerate(SECTIONS):
+                self.get_section("_" + k, i)
+
+    def split_sections(self, n):
+        # splits off sections (as lists of their stripped non-blank lines) until there are n of them, or no more
+        while self.unparsed and (n is None or len(self.sections) < n):
+            text, pos, section_end = self.unparsed
+            m = section_end.search(text, pos)
+            if m:
+                section = text[pos:m.start()]
+                self.unparsed = (text, m.end(), section_end)
+            else:
+                section = text[pos:]
+                self.unparsed = None
 
-        for line in xd_contents.splitlines():
             # leading whitespace is decorative
-            line = line.strip()
+            lines = filter(None, [ line.strip() for line in section.splitlines() ])
+            if lines:
+                self.sections.append(lines)
+
+        while n is not None and len(self.sections) < n:
+            self.sections.append([ ])
+
+    @staticmethod
+    def parse_headers(lines):
+        headers = [ ]
+        for line in lines:
+            if ":" in line:
+                k, v = line.split(":", 1)
+                k, v = k.strip(), v.strip()
+
+                headers.append((intern_value(k), v))
+            else:
+                headers.append(("", line))  # be permissive
 
-            # collapse consecutive lines of whitespace into one line and start next group
-            if not line:
-                nblanklines += 1
-                continue
+        return headers
+
+    @staticmethod
+    def parse_grid(lines):
+        return list(lines)
+
+    @staticmethod
+    def parse_clues(lines):
+        intern_answer = interned.setdefault
+
+        clues = [ ]
+        for line in lines:
+            # across or down clues
+            answer_idx = line.rfind("~")
+            if answer_idx > 0:
+                clue = line[:answer_idx]
+                answer = line[answer_idx+1:].strip()
             else:
-                if nblanklines >= 2:
-                    section += 1
-                    subsection = 1
-                    nblanklines = 0
-                elif nblanklines == 1:
-                    subsection += 1
-                    nblanklines = 0
-
-            if section == 1:
-                # headers first
-                if ":" in line:
-                    k, v = line.split(":", 1)
-                    k, v = k.strip(), v.strip()
-
-                    self.headers.append((k, v))
-                else:
-                    self.headers.append(("", line))  # be permissive
-            elif section == 2:
-                # grid second
-                self.grid.append(line)
-            elif section == 3:
-                # across or down clues
-                answer_idx = line.rfind("~")
-                if answer_idx > 0:
-                    clue = line[:answer_idx]
-                    answer = line[answer_idx+1:]
-                else:
-                    clue, answer = line, ""
+                clue, answer = line, ""
 
-                clue_idx = clue.find(".")
+            clue_idx = clue.find(".")
 
-                assert clue_idx > 0, "no clue number: " + clue
-                pos = clue[:clue_idx].strip()
-                clue = clue[clue_idx+1:]
+            assert clue_idx > 0, "no clue number: " + clue
+            posstr = clue[:clue_idx]
+            clue = clue[clue_idx+1:]
 
-                if pos[0] in string.uppercase:
-                    cluedir = pos[0]
-                    cluenum = pos[1:]
-                else:
-                    cluedir = ""
-                    cluenum = pos
+            pos = clue_positions.get(posstr)
+            if not pos:
+                pos = clue_positions[posstr] = parse_clue_position(posstr.strip())
 
-                self.clues.append(((cluedir, cluenum), clue.strip(), answer.strip()))
-            else: # anything remaining
-                if line:
-                    self.notes += line + EOL
+            clues.append((pos, clue.strip(), intern_answer(answer, answer)))
 
-    def to_unicode(self):
-        # headers (section 1)
+        return clues
 
-        r = u"" 
+    @staticmethod
+    def parse_notes(sections):
+        return "".join(line + EOL for lines in sections for line in lines)
+
+    def iter_unicode(self):
+        # yields the .xd text a section at a time, already normalized.
+        # every piece ends with EOL, so normalizing them separately is the same as doing it all at once.
+
+        # headers (section 1)
+        r = [ ]
         for k, v in self.headers:
             if v:
-                r += "%s: %s" % (k or "Header", v)
-            r += EOL
+                r.append(u"%s: %s" % (k or "Header", v))
+            r.append(EOL)
 
-        r += EOL + EOL
+        r.append(EOL + EOL)
+        yield normalize_text(u"".join(r))
 
         # grid (section 2)
-        r += EOL.join(self.grid)
-        r += EOL + EOL
+        yield normalize_text(EOL.join(self.grid) + EOL + EOL)
 
         # clues (section 3)
+        r = [ ]
         prevdir = None
         for pos, clue, answer in self.clues:
             cluedir, cluenum = pos
             if cluedir != prevdir:
-                r += EOL
+                r.append(EOL)
             prevdir = cluedir
 
-            r += u"%s%s. %s ~ %s" % (cluedir, cluenum, clue.strip(), answer)
-            r += EOL
+            r.append(u"%s%s. %s ~ %s" % (cluedir, cluenum, clue.strip(), answer))
+            r.append(EOL)
 
         if self.notes:
-            r += EOL + EOL
-            r += self.notes
+            r.append(EOL + EOL)
+            r.append(self.notes)
 
-        r += EOL
+        r.append(EOL)
+        yield normalize_text(u"".join(r))
+
+    def write_to(self, fp, encoding="utf-8"):
+        # writes the .xd text to fp in one pass (as unicode if encoding is None)
+        for s in self.iter_unicode():
+            fp.write(s.encode(encoding) if encoding else unicode(s))
+
+    def to_unicode(self):
+        # kept until a section is set again, as the same one is often written out (or compared) many times;
+        # after changing a section in place (e.g. xd.clues.append), assign it again (xd.clues = xd.clues).
+        # Not kept for a compacted grid (see compact_grid), as those are for corpora kept in memory.
+        if self._unicode is not None:
+            return self._unicode
 
-        # some Postscript CE encodings can be caught here
-        r = r.replace(u'\x91', "'")
-        r = r.replace(u'\x92', "'")
-        r = r.replace(u'\x93', '"')
-        r = r.replace(u'\x94', '"')
-        r = r.replace(u'\x85', '...')
+        s = u"".join(self.iter_unicode())
+        if not isinstance(self._grid, xdgrid):
+            self._unicode = s
+        return s
 
-        # these are always supposed to be double-quotes
-        r = r.replace("''", '"')
 
-        return r
+# some Postscript CE encodings can be caught here
+CP1252_CHARS = { u'\x91': u"'", u'\x92': u"'", u'\x93': u'"', u'\x94': u'"', u'\x85': u'...' }
+CP1252_RE = re.compile(u"[\x91\x92\x93\x94\x85]")
+
+def normalize_text(s):
+    if CP1252_RE.search(s):
+        s = CP1252_RE.sub(lambda m: CP1252_CHARS[m.group()], s)
+
+    # these are always supposed to be double-quotes
+    return s.replace("''", '"')
 
 def get_base_filename(fn):
     path, b = os.path.split(fn)
@@ -217,28 +475,191 @@ def find_files(*paths):
             contents = file(path).read()
             yield fullfn, contents
     
-def load_corpus(*pathnames):
-    ret = { }
+def find_shards(*paths):
+    # like find_files, but only lists the .xd files (without reading them), grouped by directory.
+    # yields (shard, [ (fullfn, stamp), ... ]), where shard is (zipfn or None, dirname),
+    # and stamp changes whenever the contents of fullfn do.
+    for path in paths:
+        if stat.S_ISDIR(os.stat(path).st_mode):
+            for thisdir, subdirs, files in os.walk(path):
+                subdirs.sort()
+                entries = [ ]
+                for fn in sorted(files):
+                    if fn[0] == ".":
+                        continue
+                    fullfn = os.path.join(thisdir, fn)
+                    if fn.endswith(".zip"):
+                        for shard in find_shards(fullfn):
+                            yield shard
+                    elif fn.endswith(".xd"):
+                        st = os.stat(fullfn)
+                        entries.append((fullfn, (st.st_mtime, st.st_size)))
+                if entries:
+                    yield (None, thisdir), entries
+        elif path.endswith(".zip"):
+            shards = { }
+            with zipfile.ZipFile(path, 'r') as zf:
+                for zi in zf.infolist():
+                    if zi.filename.endswith(".xd"):
+                        dirname = os.path.dirname(zi.filename)
+                        shards.setdefault(dirname, [ ]).append((zi.filename, (zi.CRC, zi.file_size)))
+            for dirname in sorted(shards):
+                yield (path, dirname), shards[dirname]
+        elif path.endswith(".xd"):
+            st = os.stat(path)
+            yield None, [ (path, (st.st_mtime, st.st_size)) ]  # not worth caching
+
+def load_shard(shard, entries, cachedir=None, partial=False, lazy=False):
+    # returns [ (fullfn, xd) ] for the given entries of shard (as from find_shards),
+    # only parsing the ones not already in the cache (if any).
+    # partial: entries are only some of the shard, so keep the other cached ones
+    # lazy: parse sections on first use (see xdfile.parse_xd); these aren't added to the cache
+    cache = None
+    cached = { }
+    if cachedir and shard:
+        cache = xdcache.corpus_cache(cachedir)
+        cached = cache.load(shard)
+
+    ret = [ ]
+    fresh = { }
+    changed = False
+    zf = None
+    for fullfn, stamp in entries:
+        if fullfn in cached and cached[fullfn][0] == stamp:
+            xd = cached[fullfn][1]
+        else:
+            changed = True
+            try:
+                if shard and shard[0]:
+                    if not zf:
+                        zf = zipfile.ZipFile(shard[0], 'r')
+                    contents = zf.read(fullfn)
+                else:
+                    contents = file(fullfn).read()
+
+                xd = xdfile(contents, fullfn, lazy)
+                if cache and not lazy:
+                    xd.get_blank_fingerprint()  # so it's cached too
+            except Exception, e:
+                print >>sys.stderr, fullfn, unicode(e)
+                continue
+
+        fresh[fullfn] = (stamp, xd)
+        ret.append((fullfn, xd))
+
+    if zf:
+        zf.close()
+
+    if partial and changed:
+        for fullfn, v in cached.items():
+            fresh.setdefault(fullfn, v)
+
+    if cache and not lazy and (changed or len(fresh) != len(cached)):
+        cache.save(shard, fresh)
+
+    return ret
+
+def load_shards(shards, cachedir=None, jobs=1, partial=False, lazy=False):
+    # yields (fullfn, xd) for every entry of shards (as from find_shards), in order;
+    # with jobs > 1, up to that many shards are loaded at once in a pool of processes
+    if jobs <= 1:
+        for shard, entries in shards:
+            for r in load_shard(shard, entries, cachedir, partial, lazy):
+                yield r
+        return
+
+    import multiprocessing
+    import collections
+
+    pool = multiprocessing.Pool(jobs)
+    try:
+        pending = collections.deque()
+        for shard, entries in shards:
+            pending.append(pool.apply_async(load_shard, (shard, entries, cachedir, partial, lazy)))
+            if len(pending) > jobs*2:  # don't get too far ahead of the consumer
+                for r in pending.popleft().get():
+                    yield r
+
+        while pending:
+            for r in pending.popleft().get():
+                yield r
+    finally:
+        pool.terminate()
+
+def get_jobs(jobs=None):
+    # number of processes to load with: jobs, or $XDJOBS, or 1; 0 means one per cpu
+    if jobs is None:
+        jobs = int(os.environ.get("XDJOBS") or 1)
+
+    if jobs == 0:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
+
+    return jobs
+
+def match_filename(fullfn, glob=None, pubid=None, since=None, until=None):
+    # since/until are inclusive, and can be just "YYYY" or "YYYY-MM"
+    if glob and not fnmatch.fnmatch(fullfn, glob):
+        return False
+
+    if pubid or since or until:
+        m = re.match(r"([A-Za-z]*)(\d{4}-\d{2}-\d{2})", get_base_filename(fullfn))
+        abbr, datestr = m.groups() if m else ("", "")
+        if pubid and pubid not in (abbr, publishers.get(abbr.lower())) and pubid not in fullfn.split("/"):
+            return False
+        if since and not (datestr and datestr[:len(since)] >= since):
+            return False
+        if until and not (datestr and datestr[:len(until)] <= until):
+            return False
+
+    return True
+
+def iter_corpus(*pathnames, **kwargs):
+    # yields each xdfile under pathnames in turn, for single passes over the corpus
+    # that don't need all of it in memory at once.
+    # glob, pubid, since, until: only load files whose path/filename match (see match_filename)
+    # contents: keep orig_contents (default False)
+    # compact: keep grids as xdgrid (default False)
+    # lazy: only parse each section on first use (default False)
+    # cache, jobs: as for load_corpus
+    cachedir = kwargs.get("cache", os.environ.get("XDCACHE"))
+    jobs = get_jobs(kwargs.get("jobs"))
+    keep_contents = kwargs.get("contents", False)
+    compact = kwargs.get("compact", False)
+    lazy = kwargs.get("lazy", False)
+    filters = dict((k, kwargs[k]) for k in ("glob", "pubid", "since", "until") if kwargs.get(k))
+
+    def filtered_shards():
+        for shard, entries in find_shards(*pathnames):
+            entries = [ (fullfn, stamp) for fullfn, stamp in entries if match_filename(fullfn, **filters) ]
+            if entries:
+                yield shard, entries
 
     n = 0
-    for fullfn, contents in find_files(*pathnames):
-        if not fullfn.endswith(".xd"):
-            continue
+    for fullfn, xd in load_shards(filtered_shards(), cachedir, jobs, bool(filters), lazy):
+        n += 1
+        print >>sys.stderr, "\r% 6d %s" % (n, get_base_filename(fullfn)),
 
-        try:
-            basefn = get_base_filename(fullfn)
-            n += 1
-            print >>sys.stderr, "\r% 6d %s" % (n, basefn),
-            xd = xdfile(contents, fullfn)
+        if not keep_contents:
+            xd.orig_contents = None
+        if compact:
+            xd.compact_grid()
 
-            ret[basefn] = xd
-        except Exception, e:
-            print >>sys.stderr, unicode(e)
-            #if args.debug:
-            #    raise
+        yield xd
 
     print >>sys.stderr, ""
 
+def load_corpus(*pathnames, **kwargs):
+    # returns { basefn: xdfile } for everything under pathnames
+    # cache: directory to keep parsed files in between runs (default $XDCACHE, if set)
+    # jobs: number of processes to parse with (default $XDJOBS, or 1)
+    # and the filters from iter_corpus
+    kwargs.setdefault("contents", True)
+
+    ret = { }
+    for xd in iter_corpus(*pathnames, **kwargs):
+        ret[get_base_filename(xd.filename)] = xd
+
     return ret
 
 def parse_filename(fn):
@@ -264,12 +685,13 @@ def parse_filename(fn):
 def xd_filename(pubid, pubabbr, year, mon, day, unique=""):
     return "crosswords/%s/%s/%s%s-%02d-%02d%s.xd" % (pubid, year, pubabbr, year, mon, day, unique)
 
-def main_load():
-    corpus = load_corpus(*sys.argv[1:])
+def main_load(**kwargs):
+    corpus = load_corpus(*sys.argv[1:], **kwargs)
 
     if len(corpus) == 1:
         xd = corpus.values()[0]
-        print xd.to_unicode().encode("utf-8")
+        xd.write_to(sys.stdout)
+        print
     else:
         print "%s puzzles" % len(corpus)
 
@@ -0,0 +1,208 @@
+#!/usr/bin/python
+
+# a prebuilt copy of what httpxd needs of the corpus, memory-mapped on load so the server starts right away.
+#
+# Usage: xdsnapshot.py <snapshot_dir> <corpus_dir_or_zip> ...
+#
+# The snapshot has every grid, packed per size in the order of findsimilar.grid_index (so the numpy index
+# is just a view of the file), and the filename, author, answers and stamp (see xdfile.find_shards) of each
+# puzzle.  Anything else about a puzzle (e.g. for /diff) comes from parsing its .xd file again, on first use.
+
+import sys
+import os
+import os.path
+import mmap
+import array
+import zipfile
+import cPickle as pickle
+
+import xdfile
+import findsimilar
+
+SNAPSHOT_VERSION = 2
+
+def cells_path(snapdir, shape):
+    return os.path.join(snapdir, "%dx%d.cells" % shape)
+
+def encode_cells(cells):
+    # returns (typecode, bytes): a byte per cell if they're all latin-1, else 4 (utf-32)
+    try:
+        return "u1", cells.encode("latin-1") if isinstance(cells, unicode) else cells
+    except UnicodeError:
+        return "u4", cells.encode("utf-32-le")
+
+def write_snapshot(snapdir, entries):
+    # entries: [ (zip filename or None, stamp, xd) ]
+    if not os.path.isdir(snapdir):
+        os.makedirs(snapdir)
+
+    sources = dict((id(xd), (source, stamp)) for source, stamp, xd in entries)
+    index = findsimilar.grid_index([ xd for source, stamp, xd in entries ])
+
+    answers = [ ]
+    offsets = array.array("I", [ 0 ])
+    buckets = [ ]
+    for shape, (blocks, bucket) in sorted(index.buckets.items()):
+        ncells = shape[0] * shape[1]
+        ragged = { } # [i] -> rows
+        encoded = [ ]
+        for i, xd in enumerate(bucket):
+            cells = findsimilar.grid_cells(xd.grid)
+            if cells is None:
+                ragged[i] = list(xd.grid)
+                cells = "\0" * ncells
+            encoded.append(encode_cells(cells))
+
+            s = u"\n".join(sorted(xd.get_answers())).encode("utf-8")
+            answers.append(s)
+            offsets.append(offsets[-1] + len(s))
+
+        typecode = max(typecode for typecode, s in encoded)
+        with open(cells_path(snapdir, shape), "wb") as f:
+            for tc, s in encoded:
+                if tc != typecode:
+                    tc, s = "u4", s.decode("latin-1").encode("utf-32-le")
+                f.write(s)
+
+        buckets.append({ "shape": shape,
+                         "typecode": typecode,
+                         "blocks": array.array("i", blocks),
+                         "puzzles": [ (xd.filename, xd.get_header("Author")) + sources[id(xd)] for xd in bucket ],
+                         "ragged": ragged })
+
+    with open(os.path.join(snapdir, "answers.bin"), "wb") as f:
+        f.write("".join(answers))
+
+    with open(os.path.join(snapdir, "meta.pickle"), "wb") as f:
+        pickle.dump({ "version": SNAPSHOT_VERSION, "buckets": buckets, "offsets": offsets }, f, pickle.HIGHEST_PROTOCOL)
+
+def map_file(fn):
+    with open(fn, "rb") as f:
+        if not os.fstat(f.fileno()).st_size:
+            return ""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class snapshot_xd(object):
+    # stands in for an xdfile in a findsimilar.grid_index, with what the snapshot has
+    __slots__ = ('snapshot', 'shape', 'i', 'n', 'filename', 'source', 'author', '_xd')
+
+    def __init__(self, snapshot, shape, i, n, filename, source, author):
+        self.snapshot = snapshot
+        self.shape = shape
+        self.i = i  # in the bucket
+        self.n = n  # in the snapshot
+        self.filename = filename
+        self.source = source
+        self.author = author
+        self._xd = None
+
+    def __str__(self):
+        return self.filename
+
+    @property
+    def grid(self):
+        return self.snapshot.get_grid(self.shape, self.i)
+
+    def get_answers(self):
+        return self.snapshot.get_answers(self.n)
+
+    def get_header(self, fieldname):
+        if fieldname == "Author":
+            return self.author
+        return self.load().get_header(fieldname)
+
+    def load(self):
+        # the whole xdfile, parsed from its file the first time
+        if not self._xd:
+            if self.source:
+                with zipfile.ZipFile(self.source, "r") as zf:
+                    contents = zf.read(self.filename)
+            else:
+                contents = file(self.filename).read()
+            self._xd = xdfile.xdfile(contents, self.filename)
+        return self._xd
+
+def full_xdfile(xd):
+    # the real xdfile for xd, which may be from a snapshot
+    if isinstance(xd, snapshot_xd):
+        return xd.load()
+    return xd
+
+class snapshot:
+    def __init__(self, snapdir):
+        with open(os.path.join(snapdir, "meta.pickle"), "rb") as f:
+            meta = pickle.load(f)
+        assert meta["version"] == SNAPSHOT_VERSION, "snapshot is version %s, not %s" % (meta["version"], SNAPSHOT_VERSION)
+
+        self.answers = map_file(os.path.join(snapdir, "answers.bin"))
+        self.offsets = meta["offsets"]
+        self.cells = { } # [shape] -> (mmap, typecode)
+        self.ragged = { } # [shape] -> { i: rows }
+        self.corpus = { } # [basefn] -> snapshot_xd
+        self.files = { } # [(zip filename or None, filename)] -> (stamp, snapshot_xd), as httpxd keeps them
+
+        buckets = { }
+        arrays = { }
+        n = 0
+        for b in meta["buckets"]:
+            shape = b["shape"]
+            bucket = [ ]
+            for i, (filename, author, source, stamp) in enumerate(b["puzzles"]):
+                xd = snapshot_xd(self, shape, i, n + i, filename, source, author)
+                bucket.append(xd)
+                self.corpus[xdfile.get_base_filename(filename)] = xd
+                self.files[(source, filename)] = (stamp, xd)
+            n += len(bucket)
+
+            buckets[shape] = (b["blocks"].tolist(), bucket)
+            self.cells[shape] = (map_file(cells_path(snapdir, shape)), b["typecode"])
+            self.ragged[shape] = b["ragged"]
+            if findsimilar.numpy:
+                data, typecode = self.cells[shape]
+                arrays[shape] = findsimilar.numpy.frombuffer(data, "<" + typecode).reshape(len(bucket), shape[0] * shape[1])
+
+        if findsimilar.numpy:
+            ragged = dict((shape, sorted(r)) for shape, r in self.ragged.items())
+            self.haystack = findsimilar.numpy_grid_index([ ], buckets, arrays, ragged)
+        else:
+            self.haystack = findsimilar.grid_index([ ], buckets)
+
+    def get_grid(self, shape, i):
+        if i in self.ragged[shape]:
+            return self.ragged[shape][i]
+
+        data, typecode = self.cells[shape]
+        ncells = shape[0] * shape[1]
+        if typecode == "u1":
+            cells = data[i*ncells:(i+1)*ncells]
+            try:
+                cells.decode("ascii")
+            except UnicodeError:
+                cells = cells.decode("latin-1")
+        else:
+            cells = data[i*ncells*4:(i+1)*ncells*4].decode("utf-32-le")
+
+        grid = xdfile.xdgrid()
+        grid.cells, grid.width = cells, shape[1]
+        return grid
+
+    def get_answers(self, n):
+        s = self.answers[self.offsets[n]:self.offsets[n+1]]
+        return set(s.decode("utf-8").split(u"\n")) if s else set()
+
+def main():
+    snapdir = sys.argv[1]
+    entries = { } # [basefn] -> (zip filename or None, stamp, xd); as load_corpus, the last of each name
+    cachedir = os.environ.get("XDCACHE")
+    for shard, shard_entries in xdfile.find_shards(*sys.argv[2:]):
+        stamps = dict(shard_entries)
+        for fullfn, xd in xdfile.load_shard(shard, shard_entries, cachedir):
+            basefn = xdfile.get_base_filename(fullfn)
+            entries[basefn] = (shard and shard[0], stamps[fullfn], xd)
+            print >>sys.stderr, "\r% 6d %s" % (len(entries), basefn),
+
+    write_snapshot(snapdir, entries.values())
+    print >>sys.stderr, "\r%d puzzles in %s" % (len(entries), snapdir)
+
+if __name__ == "__main__":
+    main()
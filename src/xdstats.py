@@ -1,70 +1,58 @@
 #!/usr/bin/python
 
+import collections
+
 import xdfile
 
 EOL = '\n'
 
-def get_blank_grid(xd): 
-    emptygrid = ""
-    for row in xd.grid:
-        for c in row:
-            if c == BLOCK_CHAR:
-                emptygrid += BLOCK_CHAR
-            else:
-                emptygrid += "."
-        emptygrid += EOL
-            
-    return emptygrid
+def get_blank_grid(xd):
+    return "".join(row + EOL for row in xdfile.blank_grid(xd.grid))
 
-def find_grid(fn):
-    needle = get_blank_grid(xdfile(file(fn).read()))
+def find_grid(results, fn):
+    # filenames of the puzzles with the same blank grid as fn, in any rotation or reflection
+    # results: of map_reduce with map_blank_grids as "blank_grids"
+    needle = xdfile.xdfile(file(fn).read()).get_blank_fingerprint()
 
-    return [ xd for xd in corpus.values() if needle == get_blank_grid(xd) ]
+    return (results["blank_grids"] or { }).get(needle, [ ])
 
-def get_all_words():
+def get_all_words(xds):
     ret = { } # ["ANSWER"] = number of uses
-    for xd in corpus.values():
+    for xd in xds:
         for pos, clue, answer in xd.clues:
             ret[answer] = ret.get(answer, 0) + 1
 
     return ret
 
-def most_used_grids(n=1):
-    import itertools
-
-    all_grids = { }
-    for xd in corpus.values():
-        empty = get_blank_grid(xd)
+def get_duplicate_puzzles(results):
+    # [ [ (filename, author), ... ] ] with the same filled grid, even if rotated or reflected
+    # results: of map_reduce with map_grids as "grids"
+    return sorted(sorted(v) for v in (results["grids"] or { }).values() if len(v) > 1)
 
-        if empty not in all_grids:
-            all_grids[empty] = [ ]
+def load_puzzle(pathnames, fullfn):
+    # just the one file of the corpus at pathnames (which may be in a .zip)
+    for shard, entries in xdfile.find_shards(*pathnames):
+        for entry in entries:
+            if entry[0] == fullfn:
+                return xdfile.load_shard(shard, [ entry ])[0][1]
 
-        all_grids[empty].append(xd.filename)
+def most_used_grids(results, pathnames, n=1):
+    # results: of map_reduce over pathnames with map_blank_grids as "blank_grids"
+    import itertools
 
-    print "%s distinct grids out of %s puzzles" % (len(all_grids), len(corpus))
+    all_grids = results["blank_grids"] or { } # [blank grid fingerprint] -> [ filename, ... ]
+    print "%s distinct grids out of %s puzzles" % (len(all_grids), sum(len(v) for v in all_grids.values()))
 
     most_used = sorted(all_grids.items(), key=lambda x: -len(x[1]))
 
     for k, v in most_used[0:n]:
         print "used %s times" % len(v)
-        gridlines = k.splitlines()
-        for g, u in itertools.izip_longest(gridlines, sorted(v)):
+        v = sorted(v)
+        gridlines = get_blank_grid(load_puzzle(pathnames, v[0])).splitlines()  # only these few are drawn
+        for g, u in itertools.izip_longest(gridlines, v):
             print "%15s    %s" % (u or "", g or "")
         print
 
-def get_duplicate_puzzles():
-    dupgrids = { }
-    grids = { }
-    for xd in corpus.values():
-        g = EOL.join(xd.grid)
-        if g not in grids:
-            grids[g] = [ xd ]
-        else:
-            grids[g].append(xd)
-            dupgrids[g] = grids[g]
-
-    return dupgrids.values()
-
 def load_corpus_zip(pathname):
     ret = { }
 
@@ -89,23 +77,44 @@ def load_corpus(pathname):
     
     return ret
 
+# mappers for mapreduce.map_reduce
+def map_puzzles(xd):
+    return 1
+
+def map_words(xd):
+    return collections.Counter(answer for pos, clue, answer in xd.clues)
+
+def map_grids(xd):
+    # [filled grid hash] -> [ (filename, author) ]
+    return { xd.get_grid_hashes()[0]: [ (xd.filename, xd.get_header("Author") or "???") ] }
+
+def map_blank_grids(xd):
+    # [blank grid fingerprint] -> [ filename ]
+    return { xd.get_blank_fingerprint(): [ xd.filename ] }
+
 if __name__ == "__main__":
     import sys
+    import mapreduce
 
-    corpus = xdfile.main_load()
+    results = mapreduce.map_reduce({ "puzzles": map_puzzles,
+                                     "words": map_words,
+                                     "grids": map_grids,
+                                     "blank_grids": map_blank_grids }, *sys.argv[1:])
+    print "%s puzzles" % (results["puzzles"] or 0)
 
     print "Duplicates:"
-    for xds in get_duplicate_puzzles():
-        if len(xds) > 1:
-            print " ".join(sorted(xd.filename for xd in xds))
-            authors = [ xd.get_header("Author") or "???" for xd in xds ]
-            if len(set(authors)) > 1:
-                print "\tdifferent authors: " + " ".join(authors)
+    for puzzles in get_duplicate_puzzles(results):
+        print " ".join(fn for fn, author in puzzles)
+        authors = [ author for fn, author in puzzles ]
+        if len(set(authors)) > 1:
+            print "\tdifferent authors: " + " ".join(authors)
     print
 
-    all_words = get_all_words()
+    all_words = results["words"] or { }
     print "%d unique words.  most used words:" % len(all_words)
     for word, num_uses in sorted(all_words.items(), key=lambda x: -x[1])[0:10]:
         print num_uses, word
     print
 
+    print "Most used grid:"
+    most_used_grids(results, sys.argv[1:])